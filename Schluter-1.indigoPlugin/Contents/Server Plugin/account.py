@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import threading
+import time
+import concurrent.futures
+from authenticator import Authenticator, Authentication, AuthenticationState
+
+# The account set up in the plugin config; account devices use their device ID as the key
+DEFAULT_ACCOUNT = "default"
+
+# Seconds between checks that the session is still valid
+AUTH_CHECK_INTERVAL = 300.0
+
+DEFAULT_REFRESH_CONCURRENCY = 4
+
+class SchluterAccount:
+
+    # One Schluter login with its own client, so its own HTTP pool and metrics, and its own session.
+    # Refreshes and re-authentication for the account run on the account's thread, and individual
+    # refreshes on its own refresh_executor, so a slow or locked-out account only holds up its own
+    # thermostats. on_auth_failure(key) is called when the client's session could not be renewed
+    def __init__(self, key, name, email, password, client, token_store, on_auth_failure=None, refresh_concurrency=DEFAULT_REFRESH_CONCURRENCY):
+        self.key = key
+        self.name = name
+        self.client = client
+        self._email = email
+        self._password = password
+        self._token_store = token_store
+        self._on_auth_failure = on_auth_failure
+        self.authentication = Authentication(AuthenticationState.REQUIRES_AUTHENTICATION, None, None)
+        self.auth_next_update = 0.0
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="SchluterAccount")
+        self._refresh_concurrency = refresh_concurrency
+        self.refresh_executor = concurrent.futures.ThreadPoolExecutor(max_workers=refresh_concurrency, thread_name_prefix="SchluterRefresh")
+        self._lock = threading.Lock()
+        self._queued = set()
+        self._pending_device_ids = set()
+        self._pending_all = False
+        self.logger = logging.getLogger("Plugin.SchluterAccount")
+
+        stored = token_store.load(email) if token_store is not None and email else None
+        if stored is not None:
+            self.logger.debug(f"{name}: found stored session, expires {str(stored.expires)}")
+            self.authentication = stored
+        client.set_reauthenticator(self.reauthenticate)
+
+    @property
+    def email(self):
+        return self._email
+
+    @property
+    def session_id(self):
+        return self.authentication.session_id
+
+    @property
+    def connected(self):
+        return self.authentication.state is AuthenticationState.AUTHENTICATED
+
+    def set_credentials(self, email, password):
+        self._email = email
+        self._password = password
+
+    # Running refreshes finish on the old pool
+    def set_refresh_concurrency(self, refresh_concurrency):
+        if refresh_concurrency == self._refresh_concurrency:
+            return
+        previous = self.refresh_executor
+        self._refresh_concurrency = refresh_concurrency
+        self.refresh_executor = concurrent.futures.ThreadPoolExecutor(max_workers=refresh_concurrency, thread_name_prefix="SchluterRefresh")
+        previous.shutdown(wait=False)
+
+    # Reuses the current session while it is valid unless fresh is set. Returns the new Authentication
+    def authenticate(self, fresh=False):
+        cache = self.authentication
+        if fresh:
+            if self._token_store is not None:
+                self._token_store.discard(self._email)
+            cache = None
+        authentication = Authenticator(self.client, self._email, self._password, cache, self._token_store).authenticate()
+        if authentication.state is AuthenticationState.AUTHENTICATED:
+            self.client.set_session(authentication.session_id)
+            self.logger.debug(f"{self.name}: authentication = {str(authentication.session_id)} - {str(authentication.expires)}")
+        else:
+            self.logger.error(f"{self.name}: authentication failed - {authentication.state.value}")
+        self.authentication = authentication
+        self.auth_next_update = time.time() + AUTH_CHECK_INTERVAL
+        return authentication
+
+    # Called by the client, at most once at a time, when the server rejects the session ID.
+    # Returns the new session ID for the client to replay the rejected requests with
+    def reauthenticate(self):
+        authentication = self.authenticate(fresh=True)
+        if authentication.state is not AuthenticationState.AUTHENTICATED:
+            if self._on_auth_failure is not None:
+                self._on_auth_failure(self.key)
+            return None
+        return authentication.session_id
+
+    # Queues refresh(account, device_ids, refresh_all) on the account's thread. Requests made while one is
+    # still queued are merged into it
+    def request_refresh(self, device_ids, refresh_all, refresh):
+        with self._lock:
+            self._pending_device_ids.update(device_ids)
+            self._pending_all = self._pending_all or refresh_all
+        self._submit_once("refresh", self._run_refresh, refresh)
+
+    # Queues an authentication check on the account's thread; then(account) runs after it. A fresh login
+    # is queued apart from a plain check, so one already waiting doesn't swallow it
+    def request_authentication(self, fresh, then=None):
+        self._submit_once("login" if fresh else "authenticate", self._run_authentication, fresh, then)
+
+    # Queues discover(account) on the account's thread unless a discovery is already queued
+    def request_discovery(self, discover):
+        self._submit_once("discover", discover, self)
+
+    # Waits for the work queued so far to finish
+    def drain(self, timeout=None):
+        try:
+            self._executor.submit(lambda: None).result(timeout)
+        except (concurrent.futures.TimeoutError, RuntimeError):
+            pass
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self.refresh_executor.shutdown(wait=False, cancel_futures=True)
+        self.client.close()
+
+    def _submit_once(self, name, function, *args):
+        with self._lock:
+            if name in self._queued:
+                return
+            self._queued.add(name)
+        try:
+            self._executor.submit(self._run, name, function, *args)
+        except RuntimeError:
+            # Closed
+            with self._lock:
+                self._queued.discard(name)
+
+    def _run(self, name, function, *args):
+        with self._lock:
+            self._queued.discard(name)
+        try:
+            function(*args)
+        except Exception as error:
+            self.logger.exception(f"{self.name}: {name} failed - {error}")
+
+    def _run_refresh(self, refresh):
+        with self._lock:
+            device_ids = self._pending_device_ids
+            refresh_all = self._pending_all
+            self._pending_device_ids = set()
+            self._pending_all = False
+        refresh(self, device_ids, refresh_all)
+
+    def _run_authentication(self, fresh, then):
+        self.authenticate(fresh)
+        if then is not None:
+            then(self)
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+
+import threading
+from bisect import bisect_left
+
+# Upper bounds of the latency histogram buckets in milliseconds; the last bucket is open ended
+LATENCY_BUCKETS_MS = (5, 10, 20, 35, 50, 75, 100, 150, 200, 300, 500, 750, 1000, 1500, 2000, 3000, 5000, 7500, 10000, 20000)
+
+class LatencyHistogram:
+
+    # Fixed buckets keep recording O(log buckets) with constant memory; percentiles are interpolated within a bucket
+    def __init__(self):
+        self._counts = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self._total = 0
+        self._sum = 0.0
+        self._max = 0.0
+        self._last = None
+
+    def record(self, latency_ms):
+        self._counts[bisect_left(LATENCY_BUCKETS_MS, latency_ms)] += 1
+        self._total += 1
+        self._sum += latency_ms
+        self._max = max(self._max, latency_ms)
+        self._last = latency_ms
+
+    @property
+    def count(self):
+        return self._total
+
+    @property
+    def last(self):
+        return self._last
+
+    def mean(self):
+        return self._sum / self._total if self._total > 0 else None
+
+    def percentile(self, fraction):
+        if self._total == 0:
+            return None
+        rank = fraction * self._total
+        cumulative = 0
+        for index, count in enumerate(self._counts):
+            if count == 0:
+                continue
+            if cumulative + count >= rank:
+                lower = LATENCY_BUCKETS_MS[index - 1] if index > 0 else 0.0
+                upper = LATENCY_BUCKETS_MS[index] if index < len(LATENCY_BUCKETS_MS) else self._max
+                return min(lower + (upper - lower) * (rank - cumulative) / count, self._max)
+            cumulative += count
+        return self._max
+
+class EndpointMetrics:
+
+    def __init__(self):
+        self.requests = 0
+        self.status_codes = {}
+        self.timeouts = 0
+        self.connection_errors = 0
+        self.response_bytes = 0
+        self.latency = LatencyHistogram()
+
+    @property
+    def errors(self):
+        return self.timeouts + self.connection_errors + sum(count for status, count in self.status_codes.items() if status != 200)
+
+    def summary(self):
+        return {
+            'requests': self.requests,
+            'status_codes': dict(self.status_codes),
+            'timeouts': self.timeouts,
+            'connection_errors': self.connection_errors,
+            'errors': self.errors,
+            'response_bytes': self.response_bytes,
+            'latency_mean_ms': self.latency.mean(),
+            'latency_p50_ms': self.latency.percentile(0.50),
+            'latency_p95_ms': self.latency.percentile(0.95),
+            'latency_p99_ms': self.latency.percentile(0.99),
+            'latency_last_ms': self.latency.last,
+        }
+
+class ApiMetrics:
+
+    # Request counts, status codes, failures, latency and response sizes per endpoint, and per
+    # thermostat serial number for the thermostat endpoints
+    def __init__(self):
+        self._endpoints = {}
+        self._serials = {}
+        self._lock = threading.Lock()
+
+    def record_response(self, endpoint, serial_number, status_code, latency_ms, response_bytes):
+        with self._lock:
+            for metrics in self._metrics_for(endpoint, serial_number):
+                metrics.requests += 1
+                metrics.status_codes[status_code] = metrics.status_codes.get(status_code, 0) + 1
+                metrics.response_bytes += response_bytes
+                metrics.latency.record(latency_ms)
+
+    def record_failure(self, endpoint, serial_number, latency_ms, timeout):
+        with self._lock:
+            for metrics in self._metrics_for(endpoint, serial_number):
+                metrics.requests += 1
+                if timeout:
+                    metrics.timeouts += 1
+                else:
+                    metrics.connection_errors += 1
+                metrics.latency.record(latency_ms)
+
+    def endpoints(self):
+        with self._lock:
+            return { endpoint: metrics.summary() for endpoint, metrics in sorted(self._endpoints.items()) }
+
+    def endpoint(self, endpoint):
+        with self._lock:
+            metrics = self._endpoints.get(endpoint)
+            return metrics.summary() if metrics is not None else None
+
+    def serial_number(self, serial_number):
+        with self._lock:
+            metrics = self._serials.get(str(serial_number))
+            return metrics.summary() if metrics is not None else None
+
+    def reset(self):
+        with self._lock:
+            self._endpoints = {}
+            self._serials = {}
+
+    # Must be called with the lock held
+    def _metrics_for(self, endpoint, serial_number):
+        metrics = [self._endpoints.setdefault(endpoint, EndpointMetrics())]
+        if serial_number is not None:
+            metrics.append(self._serials.setdefault(str(serial_number), EndpointMetrics()))
+        return metrics
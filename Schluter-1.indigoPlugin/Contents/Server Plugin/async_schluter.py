@@ -0,0 +1,322 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import json
+import logging
+import threading
+import aiohttp
+import time
+from schluter import API_AUTH_URL, API_GET_THERMOSTATS_URL, API_SET_TEMPERATURE_URL, API_APPLICATION_ID, RENEWAL_BACKOFF, thermostats_from_groups, session_key, endpoint_name
+from http_pool import DEFAULT_POOL_SIZE, DEFAULT_IDLE_TIMEOUT
+from api_metrics import ApiMetrics
+
+# Stand-in for requests.Response so callers can use status_code/content/json() with either client
+class ApiResponse:
+    def __init__(self, status_code, content):
+        self._status_code = status_code
+        self._content = content
+
+    @property
+    def status_code(self):
+        return self._status_code
+
+    @property
+    def content(self):
+        return self._content
+
+    def json(self):
+        return json.loads(self._content)
+
+class AsyncSchluter:
+
+    def __init__(self, timeout=10, command_timeout=60, pool_size=DEFAULT_POOL_SIZE, idle_timeout=DEFAULT_IDLE_TIMEOUT):
+        self._timeout = timeout
+        self._command_timeout = command_timeout
+        self._pool_size = pool_size
+        self._idle_timeout = idle_timeout
+        self._http_session = None
+        self._stats = { 'requests': 0, 'new_connections': 0, 'reused_connections': 0 }
+        # Set when the server rejects the session ID and it couldn't be renewed; cleared by the plugin once it has re-authenticated
+        self.auth_update_needed = False
+        self._reauthenticate = None
+        self._session_id = None
+        self._session_lock = None
+        self._renewal_failed = None
+        self._renewal_failed_at = 0.0
+        self._auth_stats = { 'renewals': 0, 'replays': 0 }
+        self.metrics = ApiMetrics()
+        self.logger = logging.getLogger("Plugin.AsyncSchluter")
+
+    # reauthenticate() is a blocking call that logs in again and returns the new session ID, or None.
+    # It runs on an executor thread, so it may use the SyncSchluter facade
+    def set_reauthenticator(self, reauthenticate):
+        self._reauthenticate = reauthenticate
+
+    def set_session(self, session_id):
+        self._session_id = session_id
+
+    def auth_stats(self):
+        return dict(self._auth_stats)
+
+    # The aiohttp session has to be created on the event loop that uses it
+    async def open(self):
+        if self._http_session is not None:
+            return
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_connection_create_end.append(self._on_connection_create)
+        trace_config.on_connection_reuseconn.append(self._on_connection_reuse)
+        connector = aiohttp.TCPConnector(limit=self._pool_size, keepalive_timeout=self._idle_timeout)
+        self._http_session = aiohttp.ClientSession(connector=connector, trace_configs=[trace_config])
+
+    async def close(self):
+        if self._http_session is None:
+            return
+        await self._http_session.close()
+        self._http_session = None
+
+    async def set_pool_size(self, pool_size):
+        if pool_size == self._pool_size:
+            return
+        await self.close()
+        self._pool_size = pool_size
+
+    def connection_stats(self):
+        stats = dict(self._stats)
+        stats['pool_size'] = self._pool_size
+        # aiohttp closes idle keep-alive connections itself after idle_timeout
+        stats['idle_reaps'] = 0
+        return stats
+
+    async def _on_connection_create(self, session, context, params):
+        self._stats['new_connections'] += 1
+
+    async def _on_connection_reuse(self, session, context, params):
+        self._stats['reused_connections'] += 1
+
+    async def get_session(self, email, password):
+        self.logger.debug("get_session called")
+        response = await self._call_api(
+            "post",
+            API_AUTH_URL,
+            params = None,
+            json = {
+                'Email': email,
+                'Password': password,
+                'Application': API_APPLICATION_ID
+            })
+
+        return response
+
+    async def get_thermostats(self, sessionId):
+        self.logger.debug("get_thermostats called")
+        result = await self.get_thermostat_groups(sessionId)
+
+        if result is not None:
+            return thermostats_from_groups(result.json())
+        else:
+            return None
+
+    async def get_thermostat_groups(self, sessionId):
+        params = { 'sessionId': sessionId }
+        result = await self._call_api("get", API_GET_THERMOSTATS_URL, params)
+
+        return result
+
+    async def get_thermostat(self, sessionId, serialNumber):
+        self.logger.debug("get_temperature called")
+        params = { 'sessionId': sessionId, 'serialnumber': serialNumber }
+        result = await self._call_api("get", API_SET_TEMPERATURE_URL, params = params)
+
+        return result
+
+    async def return_to_schedule(self, sessionId, serialNumber):
+        self.logger.debug("return_to_schedule called")
+        params = { 'sessionId': sessionId, 'serialnumber': serialNumber }
+        json = { "RegulationMode": 1, "VacationEnabled": False}
+        result = await self._call_api("post", API_SET_TEMPERATURE_URL, params = params, json = json)
+
+        return result is not None
+
+    async def set_temp_next_sched(self, sessionId, serialNumber, temperature, endTime):
+        self.logger.debug("set_temp_next_sched called")
+        params = { 'sessionId': sessionId, 'serialnumber': serialNumber }
+        json = { "ComfortTemperature": temperature, "ComfortEndTime": endTime, "RegulationMode": 2, "VacationEnabled": False}
+        result = await self._call_api("post", API_SET_TEMPERATURE_URL, params = params, json = json)
+
+        return result is not None
+
+    async def set_temp_permanently(self, sessionId, serialNumber, temperature):
+        self.logger.debug("set_temp_permanently called")
+        params = { 'sessionId': sessionId, 'serialnumber': serialNumber }
+        json = { 'ManualTemperature': temperature, "RegulationMode": 3, "VacationEnabled": False}
+        result = await self._call_api("post", API_SET_TEMPERATURE_URL, params = params, json = json)
+
+        return result is not None
+
+    # Single-flight session renewal, see Schluter._renew_session
+    async def _renew_session(self, params):
+        if self._reauthenticate is None or params is None or "sessionId" not in params:
+            return None
+        if self._session_lock is None:
+            self._session_lock = asyncio.Lock()
+        rejected = session_key(params["sessionId"])
+        async with self._session_lock:
+            if self._session_id is not None and session_key(self._session_id) != rejected:
+                return self._session_id
+            if self._renewal_failed == rejected and (time.time() - self._renewal_failed_at) < RENEWAL_BACKOFF:
+                return None
+            self.logger.info("Session rejected - re-authenticating")
+            self._auth_stats['renewals'] += 1
+            session_id = await asyncio.get_running_loop().run_in_executor(None, self._reauthenticate)
+            if session_id is None:
+                self._renewal_failed = rejected
+                self._renewal_failed_at = time.time()
+                return None
+            self._session_id = session_id
+            return session_id
+
+    # Same semantics as Schluter._call_api: returns None on a connection error or a non-200 response,
+    # and a request rejected with 401 is replayed once with a renewed session
+    async def _call_api(self, method, url, params, replay = True, **kwargs):
+        payload = kwargs.get("params") or kwargs.get("json")
+        timeout = aiohttp.ClientTimeout(total=kwargs.get("timeout", self._timeout))
+        request_kwargs = { key: value for key, value in kwargs.items() if key != "timeout" }
+
+        self.logger.debug(f"Calling {str(url)} with params {str(params)} and payload={str(payload)}")
+
+        if self._http_session is None:
+            await self.open()
+        self._stats['requests'] += 1
+
+        endpoint = endpoint_name(method, url)
+        serial_number = params.get("serialnumber") if params is not None else None
+        started = time.perf_counter()
+        try:
+            async with self._http_session.request(method, url, params = _flatten_params(params), timeout = timeout, **request_kwargs) as response:
+                status_code = response.status
+                content = await response.read()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+            self.metrics.record_failure(endpoint, serial_number, (time.perf_counter() - started) * 1000.0, isinstance(error, asyncio.TimeoutError))
+            self.logger.error("Connection Error - Unable to connect - {}".format(error))
+            return None
+        self.metrics.record_response(endpoint, serial_number, status_code, (time.perf_counter() - started) * 1000.0, len(content))
+
+        if status_code != 200:
+            self.logger.error("Response Error: {}".format(status_code))
+            if status_code == 401:
+                self.logger.error("Authetication Error - will re-authenticate")
+                session_id = await self._renew_session(params) if replay else None
+                if session_id is not None:
+                    self.logger.debug("Replaying request with renewed session")
+                    self._auth_stats['replays'] += 1
+                    return await self._call_api(method, url, dict(params, sessionId = session_id), replay = False, **kwargs)
+                self.auth_update_needed = True
+            return None
+
+        self.logger.debug("Response OK")
+        self.logger.debug(f"API Response received: {str(status_code)} - {str(content)}")
+        return ApiResponse(status_code, content)
+
+# Authentication.session_id is a 1-tuple; requests expands sequences in params but aiohttp does not
+def _flatten_params(params):
+    if params is None:
+        return None
+    flat = []
+    for key, value in params.items():
+        values = value if isinstance(value, (list, tuple)) else [value]
+        for item in values:
+            flat.append((key, str(item)))
+    return flat
+
+class SyncSchluter:
+
+    # Blocking facade over AsyncSchluter with the same methods as Schluter, so Plugin callbacks
+    # can keep calling it directly. All requests are multiplexed on one event loop thread.
+    def __init__(self, client):
+        self._client = client
+        self._loop = None
+        self._thread = None
+        self.logger = logging.getLogger("Plugin.SyncSchluter")
+
+    @property
+    def client(self):
+        return self._client
+
+    @property
+    def auth_update_needed(self):
+        return self._client.auth_update_needed
+
+    @auth_update_needed.setter
+    def auth_update_needed(self, value):
+        self._client.auth_update_needed = value
+
+    def set_reauthenticator(self, reauthenticate):
+        self._client.set_reauthenticator(reauthenticate)
+
+    def set_session(self, session_id):
+        self._client.set_session(session_id)
+
+    def auth_stats(self):
+        return self._client.auth_stats()
+
+    @property
+    def metrics(self):
+        return self._client.metrics
+
+    def open(self):
+        if self._loop is not None:
+            return
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="SchluterEventLoop", daemon=True)
+        self._thread.start()
+        self.run(self._client.open())
+
+    def close(self):
+        if self._loop is None:
+            return
+        self.run(self._client.close())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        self._loop = None
+        self._thread = None
+
+    # Runs a coroutine on the client's event loop and waits for its result, e.g.
+    # run(asyncio.gather(*[client.get_thermostat(session, serial) for serial in serials]))
+    def run(self, coroutine):
+        if self._loop is None:
+            self.open()
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    def set_pool_size(self, pool_size):
+        self.run(self._client.set_pool_size(pool_size))
+
+    def reap_idle_connections(self):
+        return False
+
+    def idle_connection_deadline(self):
+        return None
+
+    def connection_stats(self):
+        return self._client.connection_stats()
+
+    def get_session(self, email, password):
+        return self.run(self._client.get_session(email, password))
+
+    def get_thermostats(self, sessionId):
+        return self.run(self._client.get_thermostats(sessionId))
+
+    def get_thermostat_groups(self, sessionId):
+        return self.run(self._client.get_thermostat_groups(sessionId))
+
+    def get_thermostat(self, sessionId, serialNumber):
+        return self.run(self._client.get_thermostat(sessionId, serialNumber))
+
+    def return_to_schedule(self, sessionId, serialNumber):
+        return self.run(self._client.return_to_schedule(sessionId, serialNumber))
+
+    def set_temp_next_sched(self, sessionId, serialNumber, temperature, endTime):
+        return self.run(self._client.set_temp_next_sched(sessionId, serialNumber, temperature, endTime))
+
+    def set_temp_permanently(self, sessionId, serialNumber, temperature):
+        return self.run(self._client.set_temp_permanently(sessionId, serialNumber, temperature))
@@ -1,8 +1,5 @@
 # -*- coding: utf-8 -*-
-import os
-import json
 import logging
-import indigo
 from enum import Enum
 from datetime import datetime, timedelta
 
@@ -38,11 +35,12 @@ class Authentication:
 
 class Authenticator:
 
-    def __init__(self, api, email, password, authentication_cache):
+    def __init__(self, api, email, password, authentication_cache, token_store = None):
         self._api = api
         self._email = email
         self._password = password
         self._authentication = authentication_cache
+        self._token_store = token_store
         self.logger = logging.getLogger("Plugin.Authenticator")
         
         if self._authentication == None :
@@ -83,6 +81,12 @@ class Authenticator:
                 self.logger.info("Authentication Successful")
         
             self._authentication = Authentication(state, session_id, expires)
+
+            if self._token_store is not None:
+                if state is AuthenticationState.AUTHENTICATED:
+                    self._token_store.save(self._email, self._authentication)
+                else:
+                    self._token_store.discard(self._email)
         else:
             self.logger.error("Authenticate - Connection Error")
             self._authentication = Authentication(AuthenticationState.CONNECTION_ERROR, None, None)
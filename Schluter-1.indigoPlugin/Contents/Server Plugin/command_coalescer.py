@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import threading
+import time
+
+# A burst ends once no command arrives for DEBOUNCE_WINDOW seconds, but is never held longer than MAX_DELAY
+DEBOUNCE_WINDOW = 1.5
+MAX_DELAY = 5.0
+
+# Setpoint limits in Schluter units (C x 100)
+MIN_SETPOINT = 500
+MAX_SETPOINT = 4000
+
+class CommandCoalescer:
+
+    # Folds bursts of relative and absolute setpoint commands for a device into one final setpoint.
+    # send(key, setpoint) is called from a timer thread once the burst has settled. While it runs, the
+    # setpoint being sent is the base for further adjustments, and the next burst waits for it to finish
+    def __init__(self, send, window=DEBOUNCE_WINDOW, max_delay=MAX_DELAY):
+        self._send = send
+        self._window = window
+        self._max_delay = max_delay
+        self._pending = {}
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self._stats = { 'commands': 0, 'sent': 0 }
+        self.logger = logging.getLogger("Plugin.CommandCoalescer")
+
+    # Adds delta to the pending setpoint; current() supplies the starting setpoint when no burst is pending or
+    # being sent, and may return None if it is unknown. Returns the new pending setpoint, or None if it couldn't be started
+    def adjust(self, key, delta, current):
+        with self._lock:
+            base = self._base(key)
+            if base is not None:
+                return self._update(key, base + delta)
+        setpoint = current()
+        if setpoint is None:
+            return None
+        with self._lock:
+            base = self._base(key)
+            return self._update(key, (base if base is not None else setpoint) + delta)
+
+    # Replaces the pending setpoint with an absolute value
+    def set(self, key, setpoint):
+        with self._lock:
+            return self._update(key, setpoint)
+
+    def pending(self, key):
+        with self._lock:
+            pending = self._pending.get(key)
+            return pending['setpoint'] if pending is not None else None
+
+    # Sends every pending setpoint now, e.g. on shutdown
+    def flush_all(self):
+        with self._lock:
+            keys = list(self._pending.keys())
+        for key in keys:
+            self._fire(key, True)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+    # These methods must be called with the lock held; _base returns the setpoint pending or being sent, if any
+    def _base(self, key):
+        pending = self._pending.get(key)
+        if pending is not None:
+            return pending['setpoint']
+        return self._in_flight.get(key)
+
+    def _update(self, key, setpoint):
+        setpoint = min(max(setpoint, MIN_SETPOINT), MAX_SETPOINT)
+        now = time.time()
+        pending = self._pending.get(key)
+        if pending is None:
+            pending = { 'started': now, 'timer': None }
+            self._pending[key] = pending
+        elif pending['timer'] is not None:
+            pending['timer'].cancel()
+        pending['setpoint'] = setpoint
+
+        delay = min(self._window, max(pending['started'] + self._max_delay - now, 0.0))
+        self._start_timer(key, pending, delay)
+
+        self._stats['commands'] += 1
+        self.logger.debug(f"{key}: pending setpoint {setpoint}, sending in {delay:.1f} seconds")
+        return setpoint
+
+    def _start_timer(self, key, pending, delay):
+        pending['timer'] = threading.Timer(delay, self._fire, [key])
+        pending['timer'].daemon = True
+        pending['timer'].start()
+
+    def _fire(self, key, now=False):
+        with self._lock:
+            pending = self._pending.get(key)
+            if pending is None:
+                return
+            pending['timer'].cancel()
+            if key in self._in_flight and not now:
+                # Send after the previous setpoint, so the two can't overtake each other
+                self._start_timer(key, pending, self._window)
+                return
+            del self._pending[key]
+            self._in_flight[key] = pending['setpoint']
+            self._stats['sent'] += 1
+        try:
+            self._send(key, pending['setpoint'])
+        finally:
+            with self._lock:
+                if self._in_flight.get(key) == pending['setpoint']:
+                    del self._in_flight[key]
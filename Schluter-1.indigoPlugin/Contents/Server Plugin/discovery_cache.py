@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+
+DEFAULT_TTL = 3600.0
+
+class DiscoveryCache:
+
+    # (serial number, room name) pairs of the thermostats in each account, for the device config dialog.
+    # Bulk polls keep an account's list current; one older than ttl seconds is stale and should be
+    # rescanned in the background, but is still returned until the rescan replaces it
+    def __init__(self, ttl=DEFAULT_TTL):
+        self._ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._stats = { 'hits': 0, 'misses': 0, 'updates': 0 }
+
+    def update(self, account_key, thermostats, fetched=None):
+        thermostat_list = sorted(((thermostat.serial_number, thermostat.name) for thermostat in thermostats), key=lambda entry: str(entry[1]))
+        with self._lock:
+            self._entries[account_key] = (thermostat_list, fetched or time.time())
+            self._stats['updates'] += 1
+
+    # Returns the account's list regardless of its age, or None if it hasn't been fetched
+    def get(self, account_key):
+        with self._lock:
+            entry = self._entries.get(account_key)
+            if entry is None:
+                self._stats['misses'] += 1
+                return None
+            self._stats['hits'] += 1
+            return list(entry[0])
+
+    def is_stale(self, account_key):
+        with self._lock:
+            entry = self._entries.get(account_key)
+            return entry is None or (time.time() - entry[1]) > self._ttl
+
+    # Marks an account's list stale without dropping it
+    def expire(self, account_key):
+        with self._lock:
+            entry = self._entries.get(account_key)
+            if entry is not None:
+                self._entries[account_key] = (entry[0], 0.0)
+
+    def evict(self, account_key):
+        with self._lock:
+            self._entries.pop(account_key, None)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['accounts'] = len(self._entries)
+            stats['thermostats'] = sum(len(entry[0]) for entry in self._entries.values())
+            return stats
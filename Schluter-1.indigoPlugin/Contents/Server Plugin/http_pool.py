@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+
+# Defaults for the persistent connection pool
+DEFAULT_POOL_SIZE = 4
+DEFAULT_IDLE_TIMEOUT = 60.0
+
+class HttpPool:
+
+    # A persistent requests session with keep-alive connections to the Schluter server.
+    # Connections that sit idle longer than idle_timeout are closed by reap_idle()
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE, idle_timeout=DEFAULT_IDLE_TIMEOUT):
+        self._pool_size = pool_size
+        self._idle_timeout = idle_timeout
+        self._session = None
+        self._adapter = None
+        self._last_used = 0.0
+        self._lock = threading.Lock()
+
+        # Statistics
+        self._requests = 0
+        self._retired_connections = 0
+        self._reaped = 0
+        self.logger = logging.getLogger("Plugin.HttpPool")
+
+    @property
+    def pool_size(self):
+        return self._pool_size
+
+    @property
+    def is_open(self):
+        return self._session is not None
+
+    def open(self):
+        with self._lock:
+            if self._session is not None:
+                return
+            self.logger.debug(f"Opening HTTP pool (pool_size = {self._pool_size})")
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self._pool_size)
+            session = requests.Session()
+            session.headers["Connection"] = "keep-alive"
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            self._adapter = adapter
+            self._session = session
+
+    def close(self):
+        with self._lock:
+            if self._session is None:
+                return
+            self.logger.debug("Closing HTTP pool")
+            self._retire_connections()
+            self._session.close()
+            self._session = None
+            self._adapter = None
+
+    def resize(self, pool_size):
+        if pool_size == self._pool_size:
+            return
+        self.close()
+        self._pool_size = pool_size
+        self.open()
+
+    def request(self, method, url, **kwargs):
+        if self._session is None:
+            self.open()
+        with self._lock:
+            self._requests += 1
+            self._last_used = time.time()
+            session = self._session
+        return session.request(method, url, **kwargs)
+
+    # Close idle keep-alive connections so we don't hold sockets the server has likely dropped
+    def reap_idle(self):
+        with self._lock:
+            if self._session is None or self._last_used == 0.0:
+                return False
+            if (time.time() - self._last_used) < self._idle_timeout:
+                return False
+            if self._open_connection_count() == 0:
+                return False
+            self.logger.debug("Reaping idle HTTP connections")
+            self._retire_connections()
+            self._adapter.poolmanager.clear()
+            self._reaped += 1
+            return True
+
+    # Time at which reap_idle() will have connections to close, or None while none are open
+    def idle_deadline(self):
+        with self._lock:
+            if self._session is None or self._last_used == 0.0 or self._open_connection_count() == 0:
+                return None
+            return self._last_used + self._idle_timeout
+
+    def stats(self):
+        with self._lock:
+            new_connections = self._retired_connections + self._open_connection_count()
+            return {
+                'pool_size': self._pool_size,
+                'requests': self._requests,
+                'new_connections': new_connections,
+                'reused_connections': max(self._requests - new_connections, 0),
+                'idle_reaps': self._reaped,
+            }
+
+    # urllib3 keeps a per-host count of connections it has created; these methods must be called with the lock held
+    def _pools(self):
+        if self._adapter is None:
+            return []
+        pools = self._adapter.poolmanager.pools
+        return [pools.get(key) for key in pools.keys()]
+
+    def _open_connection_count(self):
+        return sum(pool.num_connections for pool in self._pools() if pool is not None)
+
+    def _retire_connections(self):
+        self._retired_connections += self._open_connection_count()
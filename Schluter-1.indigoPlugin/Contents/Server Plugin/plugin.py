@@ -7,20 +7,33 @@
 import indigo
 
 import os
-import sys
 import logging
 import time
 import json # For debugging
-from datetime import datetime, timedelta
 import threading
+import concurrent.futures
 import temperature_scale
 
-from schluter import Schluter
+from schluter import Schluter, thermostats_from_groups
 from schluter_thermo import Schluter_Thermo
-from authenticator import Authenticator, Authentication, AuthenticationState
+from schedule_index import ScheduleIndex
+from thermostat_cache import ThermostatCache
+from response_fingerprints import ResponseFingerprints
+from discovery_cache import DiscoveryCache
+from poll_scheduler import PollScheduler
+from command_coalescer import CommandCoalescer
+from wake_queue import WakeQueue, WakeEvent
+from telemetry_buffer import TelemetryBuffer
+from telemetry_store import TelemetryStore
+from authenticator import Authenticator, AuthenticationState
+from token_store import TokenStore
+from account import SchluterAccount, DEFAULT_ACCOUNT, AUTH_CHECK_INTERVAL
 
 ################################################################################
 TEMPERATURE_SCALE_PLUGIN_PREF='temperatureScale'
+
+# Devices started within this many seconds of startup share one first refresh
+FIRST_REFRESH_DELAY = 2.0
 TEMP_CONVERTERS = {
 	'F': temperature_scale.Fahrenheit(),
 	'C': temperature_scale.Celsius(),
@@ -37,10 +50,6 @@ kHvacModeEnumToStrMap = {
 	indigo.kHvacMode.ProgramHeatCool	: u"program auto"
 }
 
-# Global variables
-auth_update_needed = True
-update_needed = True
-
 class Plugin(indigo.PluginBase):
 	def __init__(self, pluginId, pluginDisplayName, pluginVersion, pluginPrefs):
 		indigo.PluginBase.__init__(self, pluginId, pluginDisplayName, pluginVersion, pluginPrefs)
@@ -51,49 +60,94 @@ class Plugin(indigo.PluginBase):
 		self.indigo_log_handler.setLevel(self.logLevel)
 		self.plugin_file_handler.setLevel(self.logLevel)
 		self.logger.debug(f"logLevel = {self.logLevel}")
-		
-		self.authentication_cache = Authentication(AuthenticationState.REQUIRES_AUTHENTICATION, None, None)
 
 	def startup(self):
 		self.logger.info("Starting Schluter")
-		global auth_update_needed
-		global update_needed
-
-		self.schluter = Schluter()
+		
+		# Work for runConcurrentThread, which otherwise sleeps until the next poll or authentication check is due
+		self.wakeQueue = WakeQueue()
+		
+		# Schluter accounts by key: the plugin config's account plus one per account device
+		self.accounts = {}
 
 		self.updateFrequency = float(self.pluginPrefs.get('updateFrequency', "10")) *  60.0
 		self.logger.debug(f"updateFrequency = {self.updateFrequency}")
-		self.next_update = time.time() + self.updateFrequency
-		update_needed = False
 		
-		self.current_setpoint = 0.0
-		self.display_setpoint = 0
+		# Per-device poll times, adapted around updateFrequency to each thermostat's activity
+		self.pollScheduler = PollScheduler(self.updateFrequency, lambda: self.wakeQueue.post(WakeEvent.RESCHEDULE))
+		
+		self.bulkRefresh = bool(self.pluginPrefs.get('bulkRefresh', True))
+		self.logger.debug(f"bulkRefresh = {self.bulkRefresh}")
+		
+		# Each account refreshes up to refreshConcurrency devices at a time on its own worker pool
+		self.refreshConcurrency = int(self.pluginPrefs.get('refreshConcurrency', "4"))
+		self.refreshDeadline = float(self.pluginPrefs.get('refreshDeadline', "60"))
+		self.logger.debug(f"refreshConcurrency = {self.refreshConcurrency}, refreshDeadline = {self.refreshDeadline}")
+		self.refreshesInFlight = set()
+		self.stateLock = threading.Lock()
+		
+		# Last values pushed to the Indigo server per device, used to send only changed states
+		self.pushedStates = {}
+		self.stateWriteStats = { 'calls_sent': 0, 'calls_skipped': 0, 'keys_sent': 0, 'keys_suppressed': 0 }
+		
+		# Latest thermostat snapshot per serial number, used by the action handlers
+		self.thermostatCache = ThermostatCache(float(self.pluginPrefs.get('snapshotTTL', "120")))
+		
+		# Digests of the last poll responses, so an unchanged response is not decoded again, and the snapshot
+		# each device's states were last built from, which an unchanged response leaves as they are
+		self.responseFingerprints = ResponseFingerprints()
+		self.appliedSnapshots = {}
+		self.fingerprintStats = { 'updates_skipped': 0 }
+		
+		# Serial numbers and rooms per account for the device config dialog, fetched in the background
+		self.discoveryCache = DiscoveryCache()
 		
-		self.schedules = None
-		self.tzoffset = None
+		# Folds bursts of setpoint actions into one POST per device
+		self.commandCoalescer = CommandCoalescer(self._sendCoalescedSetpoint)
+		
+		# Regulation mode and setpoint each accepted command should produce, by serial number, until a poll confirms them
+		self.pendingCommands = {}
+		self.commandStats = { 'optimistic': 0, 'confirmed': 0, 'corrected': 0 }
+		
+		# Compiled weekly schedules per serial number, rebuilt only when the schedule payload changes
+		self.scheduleIndexes = {}
+		
+		# Readings from every poll, downsampled to 5-minute and hourly means as they age
+		self.telemetryBuffer = TelemetryBuffer()
 		
 		scale = self.pluginPrefs.get(TEMPERATURE_SCALE_PLUGIN_PREF, 'C')
 		self.logger.debug(f"setting temperature scale to {scale}")
 		self.temperatureFormatter = TEMP_CONVERTERS[scale]
 		
-		self.authenticator = Authenticator(self.schluter, self.pluginPrefs["login"], self.pluginPrefs["password"], self.authentication_cache)
-		self.authentication = self.authenticator.authenticate()
-		if self.authentication.state is AuthenticationState.CONNECTION_ERROR:
-			self.logger.error("Startup Authentication = Connection Error")
-		else:
-			self.authentication_cache = self.authentication
-			self.logger.debug(f"Startup Authentication = {str(self.authentication.session_id)} - {str(self.authentication.expires)}")
-		self.auth_next_update = time.time() + 300.0
-		auth_update_needed =  False
+		self.apiMetricsStates = bool(self.pluginPrefs.get('apiMetricsStates', False))
+		
+		pluginDataFolder = os.path.join(indigo.server.getInstallFolderPath(), "Preferences", "Plugins", self.pluginId)
+		
+		# Poll history on disk, kept across restarts for telemetryRetention days
+		self.telemetryStore = TelemetryStore(os.path.join(pluginDataFolder, "telemetry"), int(self.pluginPrefs.get('telemetryRetention', "30")))
+		
+		# Sessions from before a restart are reused while they are still valid - authenticate() then skips the login
+		self.tokenStore = TokenStore(pluginDataFolder)
+		
+		# Devices started by Indigo after startup are first refreshed together, see deviceStartComm
+		self.firstRefreshAt = time.time() + FIRST_REFRESH_DELAY
+		
+		# The plugin config's account; account devices add theirs in deviceStartComm
+		account = self._createAccount(DEFAULT_ACCOUNT, self.pluginPrefs["login"], self.pluginPrefs["login"], self.pluginPrefs["password"])
+		self._startAuthentication(account)
 
 	
 	def shutdown(self):
 		self.logger.info("Stopping Schluter")
+		self.commandCoalescer.flush_all()
+		for account in list(self.accounts.values()):
+			account.close()
+		self.telemetryStore.close()
 	
 	def validatePrefsConfigUi(self, valuesDict):
 		self.logger.debug("validatePrefsConfigUi called")
 # 		do an authentication here to check entered values
-		authenticator = Authenticator(self.schluter, valuesDict["login"], valuesDict["password"], None)
+		authenticator = Authenticator(self.accounts[DEFAULT_ACCOUNT].client, valuesDict["login"], valuesDict["password"], None)
 		authentication = authenticator.authenticate()
 
 		errorDict = indigo.Dict()
@@ -113,6 +167,45 @@ class Plugin(indigo.PluginBase):
 		if (updateFrequency < 3) or (updateFrequency > 60):
 			errorDict['updateFrequency'] = "Update frequency is invalid - enter a valid number (between 3 and 60)"
 
+#		validate range for connection pool size
+		try:
+			httpPoolSize = int(valuesDict.get('httpPoolSize', "4"))
+		except ValueError:
+			httpPoolSize = 0
+		if (httpPoolSize < 1) or (httpPoolSize > 20):
+			errorDict['httpPoolSize'] = "Connection pool size is invalid - enter a valid number (between 1 and 20)"
+
+#		validate range for refresh concurrency and deadline
+		try:
+			refreshConcurrency = int(valuesDict.get('refreshConcurrency', "4"))
+		except ValueError:
+			refreshConcurrency = 0
+		if (refreshConcurrency < 1) or (refreshConcurrency > 10):
+			errorDict['refreshConcurrency'] = "Refresh concurrency is invalid - enter a valid number (between 1 and 10)"
+
+		try:
+			refreshDeadline = int(valuesDict.get('refreshDeadline', "60"))
+		except ValueError:
+			refreshDeadline = 0
+		if (refreshDeadline < 10) or (refreshDeadline > 600):
+			errorDict['refreshDeadline'] = "Refresh deadline is invalid - enter a valid number (between 10 and 600)"
+
+#		validate range for snapshot TTL
+		try:
+			snapshotTTL = int(valuesDict.get('snapshotTTL', "120"))
+		except ValueError:
+			snapshotTTL = -1
+		if (snapshotTTL < 0) or (snapshotTTL > 3600):
+			errorDict['snapshotTTL'] = "Snapshot lifetime is invalid - enter a valid number (between 0 and 3600)"
+
+#		validate range for telemetry retention
+		try:
+			telemetryRetention = int(valuesDict.get('telemetryRetention', "30"))
+		except ValueError:
+			telemetryRetention = -1
+		if (telemetryRetention < 0) or (telemetryRetention > 365):
+			errorDict['telemetryRetention'] = "Telemetry retention is invalid - enter a valid number (between 0 and 365)"
+
 		if len(errorDict) > 0 :
 			if authentication.state.value == "connection_error":
 				if valuesDict["login"] != self.pluginPrefs["login"]  or valuesDict["password"] != self.pluginPrefs["password"] :
@@ -124,8 +217,6 @@ class Plugin(indigo.PluginBase):
 
 	def closedPrefsConfigUi(self, valuesDict, userCancelled):
 		self.logger.debug("closedPrefsConfigUi called")
-		global auth_update_needed
-		global update_needed
 		
 		if not userCancelled:
 			try:
@@ -137,69 +228,200 @@ class Plugin(indigo.PluginBase):
 			
 			self.updateFrequency = float(valuesDict['updateFrequency']) * 60.0
 			self.logger.debug(f"updateFrequency = {self.updateFrequency}")
-			self.next_update = time.time()
-			update_needed = True
+			self.pollScheduler.base_interval = self.updateFrequency
+			self.wakeQueue.post(WakeEvent.REFRESH_ALL)
 			
-			self.authenticator = Authenticator(self.schluter, valuesDict["login"], valuesDict["password"], None)
-			self.authentication = self.authenticator.authenticate()
-			if self.authentication.state is AuthenticationState.CONNECTION_ERROR:
-				self.logger.error("Authentication = Connection Error")
-			else:
-				self.authentication_cache = self.authentication
-			self.auth_next_update = time.time() + 300.0
-			auth_update_needed =  False
+			self.bulkRefresh = bool(valuesDict.get('bulkRefresh', True))
+			self.logger.debug(f"bulkRefresh = {self.bulkRefresh}")
+			
+			for account in list(self.accounts.values()):
+				account.client.set_pool_size(int(valuesDict.get('httpPoolSize', "4")))
+			
+			self.refreshDeadline = float(valuesDict.get('refreshDeadline', "60"))
+			self.refreshConcurrency = int(valuesDict.get('refreshConcurrency', "4"))
+			for account in list(self.accounts.values()):
+				account.set_refresh_concurrency(self.refreshConcurrency)
+			self.logger.debug(f"refreshConcurrency = {self.refreshConcurrency}, refreshDeadline = {self.refreshDeadline}")
+			
+			self.thermostatCache.ttl = float(valuesDict.get('snapshotTTL', "120"))
+			
+			self.telemetryStore.retention_days = int(valuesDict.get('telemetryRetention', "30"))
+			
+			account = self.accounts[DEFAULT_ACCOUNT]
+			account.name = valuesDict["login"]
+			account.set_credentials(valuesDict["login"], valuesDict["password"])
+			# Log in with the new credentials on the account's thread, like every other authentication
+			account.auth_next_update = time.time() + AUTH_CHECK_INTERVAL
+			account.request_authentication(True, lambda account, wasConnected=account.connected: self._credentialsChecked(account, wasConnected))
 
-			self.temperatureFormatter = temperature_scale.Celsius()
 			scale = valuesDict[TEMPERATURE_SCALE_PLUGIN_PREF]
 			self.logger.debug(f"setting temperature scale to {scale}")
 			self.temperatureFormatter = TEMP_CONVERTERS[scale]
+			
+			# Rebuild every device's states on the next poll, in case the scale changed
+			with self.stateLock:
+				self.appliedSnapshots.clear()
+
+			# Adding or removing the API metrics states changes every device's state list
+			apiMetricsStates = bool(valuesDict.get('apiMetricsStates', False))
+			if apiMetricsStates != self.apiMetricsStates:
+				self.apiMetricsStates = apiMetricsStates
+				for dev in indigo.devices.iter("self.SchluterThermostat"):
+					dev.stateListOrDisplayStateIdChanged()
 
 			self.logger.debug("updating authentication")
 			
 	
+	# Each account has its own client, so its own connection pool. Requests rejected with 401 are
+	# re-authenticated by the account and replayed by the client; if that fails the main loop tries again
+	def _createAccount(self, key, name, email, password):
+		client = self._createSchluterClient(int(self.pluginPrefs.get('httpPoolSize', "4")))
+		client.open()
+		account = SchluterAccount(key, name, email, password, client, self.tokenStore, lambda key: self.wakeQueue.post(WakeEvent.REAUTHENTICATE, key), self.refreshConcurrency)
+		self.accounts[key] = account
+		return account
+	
+	# Logs in on the account's thread, so startup doesn't wait on the server. The account's devices are polled
+	# once it has logged in, see _authenticationChecked
+	def _startAuthentication(self, account):
+		account.auth_next_update = time.time() + AUTH_CHECK_INTERVAL
+		account.request_authentication(False, lambda account: self._authenticationChecked(account, False))
+	
+	def _accountFor(self, dev):
+		return self.accounts.get(dev.pluginProps.get("account", DEFAULT_ACCOUNT))
+	
+	# Enabled, configured thermostat devices, optionally only those bound to account
+	def _thermostatDevices(self, account=None):
+		devices = [dev for dev in indigo.devices.iter("self.SchluterThermostat") if dev.enabled and dev.configured]
+		if account is not None:
+			devices = [dev for dev in devices if dev.pluginProps.get("account", DEFAULT_ACCOUNT) == account.key]
+		return devices
+	
+	# Groups devices by the account they are bound to; devices whose account isn't running are left out
+	def _devicesByAccount(self, devices):
+		groups = {}
+		for dev in devices:
+			account = self._accountFor(dev)
+			if account is None:
+				self.logger.warning(f"{dev.name}: account {dev.pluginProps.get('account', DEFAULT_ACCOUNT)} is not running")
+				continue
+			groups.setdefault(account.key, (account, []))[1].append(dev)
+		return list(groups.values())
+	
+	# The asyncio client is optional since it needs aiohttp; changing it takes effect on restart
+	def _createSchluterClient(self, pool_size):
+		if self.pluginPrefs.get('asyncClient', False):
+			try:
+				from async_schluter import AsyncSchluter, SyncSchluter
+				self.logger.debug("Using asyncio Schluter client")
+				return SyncSchluter(AsyncSchluter(pool_size=pool_size))
+			except ImportError as error:
+				self.logger.error(f"Unable to load asyncio Schluter client, using default client - {error}")
+		return Schluter(pool_size=pool_size)
+	
 	########################################
 	
 	def runConcurrentThread(self):
 		self.logger.debug("runConcurrentThread starting")
-		global auth_update_needed
-		global update_needed
 		try:
 			while True:
+				events = self.wakeQueue.wait(self._nextWakeup())
+				if self.stopThread:
+					raise self.StopThread
+				refreshAll = (WakeEvent.REFRESH_ALL, None) in events
+				requestedDeviceIds = [key for event, key in events if event is WakeEvent.REFRESH_DEVICE]
+				rejectedAccounts = set(key for event, key in events if event is WakeEvent.REAUTHENTICATE)
+				
 #				check if we need to re-autheticate every loop
-				if (time.time() > self.auth_next_update) or auth_update_needed:
-					self.logger.info("Checking authentication")
-					self.authenticator = Authenticator(self.schluter, self.pluginPrefs["login"], self.pluginPrefs["password"], self.authentication_cache)
-					self.authentication = self.authenticator.authenticate()
-					if self.authentication.state is AuthenticationState.CONNECTION_ERROR:
-						self.logger.error("Periodic Authentication = Connection Error")
-					else:
-						self.authentication_cache = self.authentication
-						self.logger.debug(f"Periodic Authentication = {str(self.authentication.session_id)} - {str(self.authentication.expires)}")
-					self.auth_next_update = time.time() + 300.0
-					auth_update_needed =  False
+				for account in list(self.accounts.values()):
+					authRejected = account.client.auth_update_needed or account.key in rejectedAccounts
+					if (time.time() > account.auth_next_update) or authRejected:
+						self.logger.info(f"Checking authentication for {account.name}")
+						if authRejected:
+							# The client couldn't renew a rejected session - log in again
+							account.client.auth_update_needed = False
+						account.auth_next_update = time.time() + AUTH_CHECK_INTERVAL
+						account.request_authentication(authRejected, lambda account, wasConnected=account.connected: self._authenticationChecked(account, wasConnected))
 				
-				# We shouldn't do any API calls unless server connection can be established
-				# This could probably be more elegant
-				if self.authentication.state is not AuthenticationState.CONNECTION_ERROR:
-	#				check if the interval time has passed
-					if (time.time() > self.next_update) or update_needed:
-	# 					update the schluter devices
-						for dev in indigo.devices.iter("self"):
-							if not dev.enabled or not dev.configured:
-								continue
-							self._refreshStatesFromHardware(dev, False, False)
-						update_needed = False
-						self.next_update = time.time() + self.updateFrequency
-
-				self.sleep(1.0)
+#				update the devices whose poll is due, plus any a status request asked for; each account refreshes on its own thread
+				dueDeviceIds = self.pollScheduler.pop_due() + requestedDeviceIds
+				if refreshAll or len(dueDeviceIds) > 0:
+					self._requestRefresh(dueDeviceIds, refreshAll)
+
+				for account in list(self.accounts.values()):
+					account.client.reap_idle_connections()
 				
 		except self.StopThread:
 			pass
 	
+	# Earliest of the next device poll and each account's next authentication check and idle connection reap
+	def _nextWakeup(self):
+		deadlines = [self.pollScheduler.next_due()]
+		for account in list(self.accounts.values()):
+			deadlines.append(account.auth_next_update)
+			deadlines.append(account.client.idle_connection_deadline())
+		deadlines = [deadline for deadline in deadlines if deadline is not None]
+		return min(deadlines) if len(deadlines) > 0 else None
+	
+	# Runs on the account's thread after an authentication check. Thermostats of an account that has just
+	# reconnected are polled straight away rather than at their next retry
+	def _authenticationChecked(self, account, wasConnected):
+		if account.key != DEFAULT_ACCOUNT and int(account.key) in indigo.devices:
+			self._pushChangedStates(indigo.devices[int(account.key)], [{'key' : "status", 'value' : account.authentication.state.value}])
+		firstRefreshIsBulk = False
+		if account.connected and not wasConnected:
+			devices = self._thermostatDevices(account)
+			for dev in devices:
+				self.pollScheduler.schedule(dev.id, max(time.time(), self.firstRefreshAt))
+			firstRefreshIsBulk = self.bulkRefresh and len(devices) > 1
+		# A bulk refresh about to run fills the discovery cache as well
+		if not firstRefreshIsBulk:
+			self._prefetchDiscovery(account)
+	
+	# Runs on the account's thread after logging in with credentials changed in the plugin config
+	def _credentialsChecked(self, account, wasConnected):
+		if account.authentication.state is AuthenticationState.CONNECTION_ERROR:
+			self.logger.error("Authentication = Connection Error")
+		self._authenticationChecked(account, wasConnected)
+	
+	# Hands each account the devices of its own to refresh
+	def _requestRefresh(self, deviceIds, refreshAll):
+		devices = self._thermostatDevices()
+		if refreshAll:
+			serialNumbers = [dev.pluginProps.get("serialNumbers", "") for dev in devices]
+			self.thermostatCache.retain(serialNumbers)
+			self.telemetryBuffer.retain(serialNumbers)
+			keep = set(str(serialNumber) for serialNumber in serialNumbers)
+			for serialNumber in [key for key in list(self.scheduleIndexes) if key not in keep]:
+				self.scheduleIndexes.pop(serialNumber, None)
+		else:
+			devices = [dev for dev in devices if dev.id in deviceIds]
+		for dev in devices:
+			if self._accountFor(dev) is None:
+				self.pollScheduler.retry(dev.id)
+		for account, accountDevices in self._devicesByAccount(devices):
+			account.request_refresh([dev.id for dev in accountDevices], refreshAll, self._refreshAccount)
+	
+	# Runs on the account's thread. A disconnected account's devices are retried at the normal interval
+	def _refreshAccount(self, account, deviceIds, refreshAll):
+		if not account.connected:
+			for dev in self._thermostatDevices(account):
+				if refreshAll or dev.id in deviceIds:
+					self.pollScheduler.retry(dev.id)
+			return
+		if refreshAll:
+			self._refreshAllDevices(account)
+		elif len(deviceIds) > 0:
+			self._refreshDueDevices(account, deviceIds)
+	
+	def stopConcurrentThread(self):
+		indigo.PluginBase.stopConcurrentThread(self)
+		self.wakeQueue.post(WakeEvent.STOP)
+	
 	
 	########################################
 	
-	def _updateDeviceStatesList(self, dev, thermostat):
+	def _updateDeviceStatesList(self, dev, thermostat, bulk=False):
 		self.logger.debug(f"{dev.name}: Updating device")
 		self.logger.debug(f"Device Details: id = {dev.id}, name = {dev.name}, model = {dev.model}, enabled = {dev.enabled}, deviceTypeId = {dev.deviceTypeId}, displayStateId = {dev.displayStateId}")
 		
@@ -248,15 +470,61 @@ class Plugin(indigo.PluginBase):
 		# _changeTempSensorValue integrated into this method
 		index = 1 # Not sure if this thermostat can even have more than 1 temp sensor
 		stateKey = "temperatureInput" + str(index)
-		self.logger.debug(f"_changeTempSensorValue: value = {self.temperatureFormatter.convertFromSchluter(thermostat.temperature)}, uiValue = {self.temperatureFormatter.format(thermostat.temperature)}")
-		update_list.append({'key' : stateKey, 'value' : self.temperatureFormatter.convertFromSchluter(thermostat.temperature), 'uiValue' : self.temperatureFormatter.format(thermostat.temperature), 'decimalPlaces' : 1})
+		value = self.temperatureFormatter.convertFromSchluter(thermostat.temperature)
+		uiValue = self.temperatureFormatter.format(thermostat.temperature)
+		self.logger.debug(f"_changeTempSensorValue: value = {value}, uiValue = {uiValue}")
+		update_list.append({'key' : stateKey, 'value' : value, 'uiValue' : uiValue, 'decimalPlaces' : 1})
 		
 		# _changeTempSetpoint integrated into this method
 		value = self.temperatureFormatter.convertFromSchluter(thermostat.display_setpoint)
-		self.logger.debug(f"_changeTempSetpoint: value = {self.temperatureFormatter.convertFromSchluter(thermostat.display_setpoint)}, uiValue = {self.temperatureFormatter.format(thermostat.display_setpoint)}")
-		update_list.append({'key' : "setpointHeat", 'value' : self.temperatureFormatter.convertFromSchluter(thermostat.display_setpoint), 'uiValue' : self.temperatureFormatter.format(thermostat.display_setpoint), 'decimalPlaces' : 1})
+		uiValue = self.temperatureFormatter.format(thermostat.display_setpoint)
+		self.logger.debug(f"_changeTempSetpoint: value = {value}, uiValue = {uiValue}")
+		update_list.append({'key' : "setpointHeat", 'value' : value, 'uiValue' : uiValue, 'decimalPlaces' : 1})
+
+		update_list.extend(self._pollStates(dev, thermostat, bulk))
 
-		dev.updateStatesOnServer(update_list)
+		self._pushChangedStates(dev, update_list)
+
+	# States that change with every poll, whether or not the thermostat's response did. A bulk request
+	# carries no serial number, so devices refreshed in bulk report the metrics of the account's bulk requests
+	def _pollStates(self, dev, thermostat, bulk=False):
+		update_list = [{'key' : "last_refreshed", 'value' : time.strftime("%Y-%m-%d %H:%M:%S")}]
+		
+		if self.apiMetricsStates:
+			account = self._accountFor(dev)
+			if account is None:
+				metrics = None
+			elif bulk:
+				metrics = account.client.metrics.endpoint("thermostats")
+			else:
+				metrics = account.client.metrics.serial_number(thermostat.serial_number)
+			if metrics is not None:
+				update_list.append({'key' : "api_requests", 'value' : metrics['requests']})
+				update_list.append({'key' : "api_errors", 'value' : metrics['errors']})
+				update_list.append({'key' : "api_latency_last", 'value' : round(metrics['latency_last_ms'] or 0), 'uiValue' : f"{metrics['latency_last_ms'] or 0:.0f} ms"})
+				update_list.append({'key' : "api_latency_p95", 'value' : round(metrics['latency_p95_ms'] or 0), 'uiValue' : f"{metrics['latency_p95_ms'] or 0:.0f} ms"})
+		return update_list
+
+	# Sends only the states whose value or uiValue differ from what was last pushed for this device,
+	# and skips the server call entirely when nothing changed
+	def _pushChangedStates(self, dev, update_list):
+		# Refresh workers run in parallel - serialize the writes into the Indigo server
+		with self.stateLock:
+			pushed = self.pushedStates.setdefault(dev.id, {})
+			changed = [state for state in update_list if pushed.get(state['key']) != (state['value'], state.get('uiValue'))]
+			
+			self.stateWriteStats['keys_suppressed'] += len(update_list) - len(changed)
+			if len(changed) == 0:
+				self.logger.debug(f"{dev.name}: no state changes")
+				self.stateWriteStats['calls_skipped'] += 1
+				return
+			
+			self.logger.debug(f"{dev.name}: updating {len(changed)} of {len(update_list)} states")
+			dev.updateStatesOnServer(changed)
+			for state in changed:
+				pushed[state['key']] = (state['value'], state.get('uiValue'))
+			self.stateWriteStats['calls_sent'] += 1
+			self.stateWriteStats['keys_sent'] += len(changed)
 	
 	########################################
 	
@@ -264,31 +532,178 @@ class Plugin(indigo.PluginBase):
 		self.logger.debug("_refreshStatesFromHardware called")
 		
 		# TODO: Setup catch for nonexistant response
-		response = self.schluter.get_thermostat(self.authentication.session_id, dev.pluginProps.get("serialNumbers", False))
+		account = self._accountFor(dev)
+		response = account.client.get_thermostat(account.session_id, dev.pluginProps.get("serialNumbers", False)) if account is not None else None
 		
 		if response is not None:
-			thermostat = Schluter_Thermo(response.json())
+			serialNumber = str(dev.pluginProps.get("serialNumbers", ""))
+			fingerprint, thermostat = self.responseFingerprints.lookup(serialNumber, response.content)
+			if thermostat is None:
+				thermostat = Schluter_Thermo(response.json())
+				self.responseFingerprints.store(serialNumber, fingerprint, thermostat)
+			self._applyThermostatToDevice(dev, thermostat)
+		else:
+			self.logger.error("Server Connection Error")
+
+	def _refreshAllDevices(self, account):
+		self._refreshDevices(self._thermostatDevices(account), self.bulkRefresh)
+
+	def _refreshDueDevices(self, account, deviceIds):
+		devices = self._thermostatDevices(account)
+		dueDevices = [dev for dev in devices if dev.id in deviceIds]
+		self.logger.debug(f"{len(dueDevices)} of {len(devices)} devices due for refresh")
+		if self.bulkRefresh and len(dueDevices) > 1:
+			# A bulk request returns every thermostat anyway, so refresh all of them with it
+			self._refreshDevices(devices, True)
+		else:
+			self._refreshDevices(dueDevices, False)
+
+	def _refreshDevices(self, devices, bulk):
+		remaining = devices
+		if bulk:
+			remaining = self._refreshAllStatesFromHardware(devices)
+		if len(remaining) > 0:
+			self._refreshDevicesInParallel(remaining)
+		
+		# Successful refreshes reschedule themselves; retry the failures at the normal interval
+		for dev in devices:
+			with self.stateLock:
+				inFlight = dev.id in self.refreshesInFlight
+			if not inFlight and not self.pollScheduler.is_scheduled(dev.id):
+				self.pollScheduler.retry(dev.id)
+
+	# Bulk refresh: one get_thermostats call per account returns every thermostat in the account,
+	# which is then fanned out to the enabled devices by serial number. A response identical to the account's
+	# previous one is not decoded again, its thermostats are the snapshots decoded last time.
+	# Returns the devices that were not in the response and still need a single device request
+	def _refreshAllStatesFromHardware(self, devices):
+		self.logger.debug("_refreshAllStatesFromHardware called")
+		
+		missing = []
+		for account, accountDevices in self._devicesByAccount(devices):
+			response = account.client.get_thermostat_groups(account.session_id)
+			if response is None:
+				self.logger.error("Server Connection Error")
+				continue
+			
+			fingerprint, thermostat_list = self.responseFingerprints.lookup(("bulk", account.key), response.content)
+			if thermostat_list is None:
+				thermostat_list = thermostats_from_groups(response.json())
+				self.responseFingerprints.store(("bulk", account.key), fingerprint, thermostat_list)
 			
-			self.schedules = thermostat.schedules
-			self.tzoffset = thermostat.tzoffset
+			thermostats = {str(thermostat.serial_number): thermostat for thermostat in thermostat_list}
+			self.logger.debug(f"Bulk refresh for {account.name} returned {len(thermostats)} thermostats")
+			self.discoveryCache.update(account.key, thermostat_list)
+			
+			for dev in accountDevices:
+				thermostat = thermostats.get(str(dev.pluginProps.get("serialNumbers", "")))
+				if thermostat is None:
+					self.logger.warning(f"{dev.name}: thermostat not found in bulk response, refreshing individually")
+					missing.append(dev)
+					continue
+				self._applyThermostatToDevice(dev, thermostat, bulk=True)
+		return missing
+
+	# Runs _refreshStatesFromHardware for several devices at once on their accounts' refresh worker pools.
+	# Waits at most refreshDeadline seconds and reports the devices that did not finish in time
+	def _refreshDevicesInParallel(self, devices):
+		self.logger.debug(f"_refreshDevicesInParallel called for {len(devices)} devices")
+		
+		futures = {}
+		for dev in devices:
+			account = self._accountFor(dev)
+			if account is None:
+				continue
+			with self.stateLock:
+				if dev.id in self.refreshesInFlight:
+					self.logger.warning(f"{dev.name}: previous refresh still running, skipping")
+					continue
+				self.refreshesInFlight.add(dev.id)
+			try:
+				futures[account.refresh_executor.submit(self._refreshWorker, dev)] = dev
+			except RuntimeError:
+				# The account's pool was replaced or closed meanwhile
+				with self.stateLock:
+					self.refreshesInFlight.discard(dev.id)
+		
+		done, not_done = concurrent.futures.wait(futures, timeout=self.refreshDeadline)
+		
+		for future in done:
+			if future.exception() is not None:
+				self.logger.error(f"{futures[future].name}: refresh failed - {future.exception()}")
+		
+		if len(not_done) > 0:
+			missed = ", ".join(sorted(futures[future].name for future in not_done))
+			self.logger.warning(f"Refresh deadline of {self.refreshDeadline:.0f} seconds missed by: {missed}")
+
+	def _refreshWorker(self, dev):
+		try:
+			self._refreshStatesFromHardware(dev, False, False)
+		finally:
+			with self.stateLock:
+				self.refreshesInFlight.discard(dev.id)
+			if not self.pollScheduler.is_scheduled(dev.id):
+				self.pollScheduler.retry(dev.id)
+
+	# An unchanged response hands back the snapshot the device's states were last built from, and then
+	# only the poll states are pushed. Telemetry is still recorded and the next poll still scheduled
+	def _applyThermostatToDevice(self, dev, thermostat, bulk=False):
+		with self.stateLock:
+			unchanged = self.appliedSnapshots.get(dev.id) is thermostat and str(thermostat.serial_number) not in self.pendingCommands
+		
+		if unchanged:
+			self.logger.debug(f"{dev.name}: response unchanged")
+			self.thermostatCache.put(thermostat)
+			self.telemetryBuffer.record(thermostat)
+			self.telemetryStore.append(thermostat)
+			self._pushChangedStates(dev, self._pollStates(dev, thermostat, bulk))
+			with self.stateLock:
+				self.fingerprintStats['updates_skipped'] += 1
+		else:
+			self._cacheThermostat(thermostat)
+			self._reconcileCommand(dev, thermostat)
+			self.telemetryBuffer.record(thermostat)
+			self.telemetryStore.append(thermostat)
 			
 			# debugging 
-			self.logger.info(f"Current temp: {str(self.temperatureFormatter.format(thermostat.temperature))}")
+			self.logger.info(f"Current temp: {self.temperatureFormatter.format(thermostat.temperature)}")
 			self.logger.debug(f"Current temp unformatted: {str(thermostat.temperature)}")
 			self.logger.debug(f"is_heating: {str(thermostat.is_heating)}")
+			self.logger.debug(f"display_setpoint = {thermostat.display_setpoint}")
 
-			# Update current stored setpoint
-			self.display_setpoint = thermostat.display_setpoint
-			self.logger.debug(f"display_setpoint = {self.display_setpoint}")
+			self._updateDeviceStatesList(dev, thermostat, bulk)
+			with self.stateLock:
+				self.appliedSnapshots[dev.id] = thermostat
+		
+		interval = self.pollScheduler.reschedule(dev.id, thermostat)
+		self.logger.debug(f"{dev.name}: next refresh in {interval:.0f} seconds")
 
-			self._updateDeviceStatesList(dev, thermostat)
-		else:
-			self.logger.error("Server Connection Error")
+	def _cacheThermostat(self, thermostat):
+		self.thermostatCache.put(thermostat)
+		self._updateScheduleIndex(thermostat)
+
+	# Returns the snapshot for this serial number, fetching it from the server only if the cached one is missing or stale
+	def _getThermostat(self, account, serialNumber, useCache=True):
+		thermostat = self.thermostatCache.get(serialNumber) if useCache else None
+		if thermostat is not None:
+			return thermostat
+		
+		if account is None:
+			return None
+		self.logger.debug(f"Snapshot for {serialNumber} missing or stale, fetching")
+		response = account.client.get_thermostat(account.session_id, serialNumber)
+		if response is None:
+			return None
+		thermostat = Schluter_Thermo(response.json())
+		self._cacheThermostat(thermostat)
+		return thermostat
 
 	########################################
 	
 	def getDeviceStateList(self, dev):
 		stateList = indigo.PluginBase.getDeviceStateList(self, dev)
+		if dev.deviceTypeId != "SchluterThermostat":
+			return stateList
 		
 		# Type:
 		#  52 = Boolean
@@ -335,39 +750,133 @@ class Plugin(indigo.PluginBase):
 							"StateLabel"   : "Regulation Mode",   
 							"TriggerLabel" : "Regulation Mode",   
 							"Type"         : 100 })
+		stateList.append({  "Disabled"     : False, 
+							"Key"          : "last_refreshed", 
+							"StateLabel"   : "Last Refreshed",   
+							"TriggerLabel" : "Last Refreshed",   
+							"Type"         : 150 })
+		
+		if self.apiMetricsStates:
+			stateList.append({  "Disabled"     : False, 
+								"Key"          : "api_requests", 
+								"StateLabel"   : "API Requests",   
+								"TriggerLabel" : "API Requests",   
+								"Type"         : 100 })
+			stateList.append({  "Disabled"     : False, 
+								"Key"          : "api_errors", 
+								"StateLabel"   : "API Errors",   
+								"TriggerLabel" : "API Errors",   
+								"Type"         : 100 })
+			stateList.append({  "Disabled"     : False, 
+								"Key"          : "api_latency_last", 
+								"StateLabel"   : "API Latency Last (ms)",   
+								"TriggerLabel" : "API Latency Last (ms)",   
+								"Type"         : 100 })
+			stateList.append({  "Disabled"     : False, 
+								"Key"          : "api_latency_p95", 
+								"StateLabel"   : "API Latency p95 (ms)",   
+								"TriggerLabel" : "API Latency p95 (ms)",   
+								"Type"         : 100 })
 				
 		return stateList
 	
 	########################################
 	def deviceStartComm(self, dev):
-		self._refreshStatesFromHardware(dev, True, True)
+		self._forgetPushedStates(dev)
+		if dev.deviceTypeId == "SchluterAccount":
+			self._startAccount(dev)
+			return
+		# No server request here: the main loop refreshes every device started around the same time with
+		# one request per account once the accounts have logged in
+		self.pollScheduler.schedule_by(dev.id, max(self.firstRefreshAt, time.time()))
+	
+	def _startAccount(self, dev):
+		account = self._createAccount(str(dev.id), dev.name, dev.pluginProps.get("login", ""), dev.pluginProps.get("password", ""))
+		self._startAuthentication(account)
 	
 	########################################
 	def deviceStopComm(self, dev):
-		pass
+		self._forgetPushedStates(dev)
+		if dev.deviceTypeId == "SchluterAccount":
+			account = self.accounts.pop(str(dev.id), None)
+			if account is not None:
+				account.close()
+			self.discoveryCache.evict(str(dev.id))
+			self.responseFingerprints.evict(("bulk", str(dev.id)))
+			return
+		self.pollScheduler.remove(dev.id)
+		self.thermostatCache.evict(dev.pluginProps.get("serialNumbers", ""))
+		self.scheduleIndexes.pop(str(dev.pluginProps.get("serialNumbers", "")), None)
+		self.responseFingerprints.evict(str(dev.pluginProps.get("serialNumbers", "")))
+	
+	def validateDeviceConfigUi(self, valuesDict, typeId, devId):
+		if typeId != "SchluterAccount":
+			return (True, valuesDict)
+		authenticator = Authenticator(self.accounts[DEFAULT_ACCOUNT].client, valuesDict.get("login", ""), valuesDict.get("password", ""), None)
+		authentication = authenticator.authenticate()
+
+		errorDict = indigo.Dict()
+		if authentication.state.value == "bad_email":
+			errorDict["login"] = "Login is invalid"
+		if authentication.state.value == "bad_password":
+			errorDict["password"] = "Password is invalid"
+		if authentication.state.value == "connection_error":
+			errorDict["showAlertText"] = "Server connection error"
+		if len(errorDict) > 0:
+			return (False, valuesDict, errorDict)
+		return (True, valuesDict)
+	
+	def _forgetPushedStates(self, dev):
+		with self.stateLock:
+			self.pushedStates.pop(dev.id, None)
+			self.appliedSnapshots.pop(dev.id, None)
 	
 	########################################
 	
+	def accountListGenerator(self, filter="", valuesDict=None, typeId="", targetId=0):
+		accounts = [(DEFAULT_ACCOUNT, f"{self.pluginPrefs.get('login', '')} (plugin config)")]
+		for dev in indigo.devices.iter("self.SchluterAccount"):
+			accounts.append((str(dev.id), dev.name))
+		return accounts
+	
+	# Reloads the thermostat list for the account just picked
+	def accountPicked(self, valuesDict, typeId, devId):
+		return valuesDict
+	
+	# Answers from the discovery cache so the dialog never waits on the server; a missing or stale list is
+	# fetched in the background and shows up the next time the list is drawn
 	def serialNumberListGenerator(self, filter="", valuesDict=None, typeId="", targetId=0):
 		self.logger.debug("get serial number called")
-				
-		sessionID = self.authentication.session_id[0]
 		
-		# TODO: Setup catch for nonexistant response
-		thermostat_list = self.schluter.get_thermostats(sessionID)
-		serial_numbers = []
-		
-		if thermostat_list is not None:
-			for thermostat in thermostat_list:
-				# The UI uses a tuple for the list: (variable name, display name)
-				tuple = (thermostat.serial_number, thermostat.name)
-				serial_numbers.append(tuple)
-		else:
-			tuple = (00000, "ERROR")
-			serial_numbers.append(tuple)
-			
+		account = self.accounts.get((valuesDict or {}).get("account", DEFAULT_ACCOUNT) or DEFAULT_ACCOUNT)
+		if account is None:
+			return [(00000, "ERROR")]
+		self._prefetchDiscovery(account)
+		
+		# The UI uses a tuple for the list: (variable name, display name)
+		serial_numbers = self.discoveryCache.get(account.key)
+		if serial_numbers is None:
+			if not account.connected:
+				return [(00000, "ERROR")]
+			return [(00000, "Searching for thermostats - reopen this dialog")]
 		return serial_numbers
 	
+	def _prefetchDiscovery(self, account):
+		if account.connected and self.discoveryCache.is_stale(account.key):
+			account.request_discovery(self._discoverThermostats)
+	
+	# Runs on the account's thread
+	def _discoverThermostats(self, account, logResult=False):
+		thermostat_list = account.client.get_thermostats(account.session_id)
+		if thermostat_list is None:
+			self.logger.error(f"Unable to list the thermostats of {account.name}")
+			return
+		for thermostat in thermostat_list:
+			self._cacheThermostat(thermostat)
+		self.discoveryCache.update(account.key, thermostat_list)
+		if logResult:
+			self.logger.info(f"Found {len(thermostat_list)} thermostats in {account.name}")
+	
 	def serialNumberPicked(self, valuesDict, typeId, devId):
 		self.logger.debug("serialNumberPicked called")
 		self.logger.debug(f"valuesDict = {json.dumps(valuesDict.to_dict())}")
@@ -378,60 +887,23 @@ class Plugin(indigo.PluginBase):
 	
 	########################################
 	
-	def getNextScheduleTime(self):
-		timezone_offset = datetime.strptime(self.tzoffset, "%z").utcoffset()
-		
-		# Derive the current date and time
-		# Convert from UTC to local time
-		current_datetime = datetime.utcnow() + timezone_offset
-		current_weekday = current_datetime.weekday()
-		current_time = current_datetime.time()
-		
-		end_time_string = None
-		incomplete = True
-		
-		# Loop through the current weekday to find the next schedule time
-		schedule_index = 0
-		while schedule_index < len(self.schedules[current_weekday]["Events"]) and incomplete:
-			schedule_time = datetime.strptime(self.schedules[current_weekday]["Events"][schedule_index]["Clock"], "%H:%M:%S").time()
-			# TODO: Possibly add a buffer so that if the next schedule time is within a few seconds of the current time we can skip ahead
-			if current_time < schedule_time and self.schedules[current_weekday]["Events"][schedule_index]["Active"]:
-				end_time_string = self.schedules[current_weekday]["Events"][schedule_index]["Clock"]
-				incomplete = False
-			else:
-				schedule_index += 1
-
-		# Move to the next weekday
-		weekday_increment = 0
-
-		# If the next schedule time is not on the current weekday, find the next valid schedule time
-		while weekday_increment < 6 and incomplete:
-			schedule_index = 0
-			weekday_increment += 1
-			while schedule_index < len(self.schedules[(current_weekday + weekday_increment) % 7]["Events"]) and incomplete:
-				# TODO: Possibly add a buffer so that if the next schedule time is within a few seconds of the current time we can skip ahead
-				if self.schedules[(current_weekday + weekday_increment) % 7]["Events"][schedule_index]["Active"]:
-					end_time_string = self.schedules[(current_weekday + weekday_increment) % 7]["Events"][schedule_index]["Clock"]
-					incomplete = False
-				else:
-					schedule_index += 1
-
-		end_datetime_string = None
-
-		# Combine the chosen schedule time to make a complete datetime string
-		if end_time_string is not None:
-			end_time = datetime.strptime(end_time_string, "%H:%M:%S").time()
-			date_diff = timedelta(days = weekday_increment)
-			# Re-convert back to UTC
-			end_datetime = current_datetime.replace(hour = end_time.hour, minute = end_time.minute, second = end_time.second, microsecond = 0) + date_diff - timezone_offset
-			end_datetime_string = end_datetime.strftime("%d/%m/%Y %H:%M:%S +00:00")
-		# This should never trigger unless there is somehow no active schedule times; Set the end time to the current time as a failsafe
-		else:
-			# Re-convert back to UTC
-			current_datetime = current_datetime - timezone_offset
-			end_datetime_string = current_datetime.strftime("%d/%m/%Y %H:%M:%S +00:00")
+	def _updateScheduleIndex(self, thermostat):
+		serialNumber = str(thermostat.serial_number)
+		index = self.scheduleIndexes.get(serialNumber)
+		if index is None or not index.matches(thermostat.schedules, thermostat.tzoffset):
+			self.logger.debug(f"Compiling schedule index for {serialNumber}")
+			self.scheduleIndexes[serialNumber] = ScheduleIndex(thermostat.schedules, thermostat.tzoffset)
 
-		return end_datetime_string
+	# Returns None if the schedule is unknown and can't be fetched - a command without an end time must not be sent
+	def getNextScheduleTime(self, account, serialNumber):
+		index = self.scheduleIndexes.get(str(serialNumber))
+		if index is None:
+			# Not polled yet - fetching the snapshot compiles its schedule
+			if self._getThermostat(account, serialNumber) is None:
+				self.logger.error("Server Connection Error")
+				return None
+			index = self.scheduleIndexes[str(serialNumber)]
+		return index.next_schedule_time()
 	
 	########################################
 	# Actions defined in MenuItems.xml:
@@ -446,15 +918,95 @@ class Plugin(indigo.PluginBase):
 			return False
 
 		serialNumber = indigo.devices[deviceId].address
+		account = self._accountFor(indigo.devices[deviceId])
 		self.logger.info(f"Resume Program for thermostat: {indigo.devices[deviceId].name}")
 
 		# TODO: Setup catch for nonexistant response
-		if self.schluter.return_to_schedule(self.authentication.session_id, serialNumber) is True:
+		if account is not None and account.client.return_to_schedule(account.session_id, serialNumber) is True:
+			self._applyCommandOptimistically(indigo.devices[deviceId], 1)
 			return True
 		else:
 			self.logger.error("Server Connection Error")
 			return False
 	
+	def menuPrintStatistics(self):
+		for account in list(self.accounts.values()):
+			self.logger.info(f"Account {account.name}: {account.authentication.state.value}, thermostats = {len(self._thermostatDevices(account))}")
+			stats = account.client.connection_stats()
+			self.logger.info(f"HTTP connections: requests = {stats['requests']}, new = {stats['new_connections']}, reused = {stats['reused_connections']}, idle reaps = {stats['idle_reaps']}, pool size = {stats['pool_size']}")
+			stats = account.client.auth_stats()
+			self.logger.info(f"Re-authentication: logins = {stats['renewals']}, replayed requests = {stats['replays']}")
+		stats = self.thermostatCache.stats()
+		self.logger.info(f"Thermostat snapshots: cached = {stats['entries']}, hits = {stats['hits']}, misses = {stats['misses']}, stale = {stats['stale']}")
+		stats = self.discoveryCache.stats()
+		self.logger.info(f"Thermostat discovery: accounts = {stats['accounts']}, thermostats = {stats['thermostats']}, lists served = {stats['hits']}, not yet fetched = {stats['misses']}, updates = {stats['updates']}")
+		stats = self.pollScheduler.stats()
+		self.logger.info(f"Poll scheduling: devices scheduled = {stats['scheduled']}, active intervals = {stats['active']}, idle intervals = {stats['idle']}, inactive intervals = {stats['inactive']}")
+		stats = self.commandCoalescer.stats()
+		self.logger.info(f"Setpoint commands: received = {stats['commands']}, sent = {stats['sent']}")
+		stats = self.wakeQueue.stats()
+		self.logger.info(f"Main loop: wakeups for events = {stats['woken']}, wakeups for deadlines = {stats['timed_out']}, events posted = {stats['posted']}, merged = {stats['merged']}")
+		stats = self.commandStats
+		self.logger.info(f"Optimistic updates: applied = {stats['optimistic']}, confirmed = {stats['confirmed']}, corrected = {stats['corrected']}")
+		stats = self.responseFingerprints.stats()
+		polls = stats['hits'] + stats['misses']
+		self.logger.info(f"Response fingerprints: responses = {polls}, unchanged = {stats['hits']} ({100.0 * stats['hits'] / max(polls, 1):.0f}%), bytes not decoded = {stats['bytes_skipped']}, device updates skipped = {self.fingerprintStats['updates_skipped']}")
+		stats = self.stateWriteStats
+		self.logger.info(f"State writes: server calls sent = {stats['calls_sent']}, skipped = {stats['calls_skipped']}, states sent = {stats['keys_sent']}, suppressed = {stats['keys_suppressed']}")
+		stats = self.telemetryBuffer.stats()
+		self.logger.info(f"Telemetry: thermostats = {stats['thermostats']}, samples recorded = {stats['samples']}, memory = {stats['bytes'] // 1024} KiB")
+		stats = self.telemetryStore.stats()
+		self.logger.info(f"Telemetry files: open = {stats['files']}, records written = {stats['appends']}, mapped = {stats['bytes'] // 1024} KiB, retention = {self.telemetryStore.retention_days} days")
+	
+	def menuRescanThermostats(self):
+		for account in list(self.accounts.values()):
+			if not account.connected:
+				self.logger.warning(f"Not rescanning {account.name}: {account.authentication.state.value}")
+				continue
+			self.logger.info(f"Rescanning thermostats in {account.name}")
+			self.discoveryCache.expire(account.key)
+			account.request_discovery(lambda account: self._discoverThermostats(account, True))
+	
+	def menuPrintTelemetry(self):
+		since = time.time() - 24 * 3600.0
+		for dev in indigo.devices.iter("self.SchluterThermostat"):
+			serialNumber = dev.pluginProps.get("serialNumbers", "")
+			# The stored history covers the time before a restart; the in-memory buffer is used when the store is off
+			averages = self.telemetryStore.averages(serialNumber, since)
+			if averages is not None:
+				temperature = averages['temperature']
+				setpoint = averages['set_point_temp']
+				heating = averages['is_heating']
+				watts = averages['load_measured_watt']
+				samples = f"{averages['records']} stored records"
+			else:
+				temperature = self.telemetryBuffer.average(serialNumber, "temperature", since)
+				if temperature is None:
+					self.logger.info(f"{dev.name}: no telemetry yet")
+					continue
+				setpoint = self.telemetryBuffer.average(serialNumber, "set_point_temp", since)
+				heating = self.telemetryBuffer.average(serialNumber, "is_heating", since)
+				watts = self.telemetryBuffer.average(serialNumber, "load_measured_watt", since)
+				resolution, times, values = self.telemetryBuffer.series(serialNumber, "temperature", since)
+				samples = f"{len(values)} {resolution} samples"
+			self.logger.info(f"{dev.name} (last 24 hours): average temperature = {self.temperatureFormatter.format(round(temperature))}, average setpoint = {self.temperatureFormatter.format(round(setpoint))}, "
+				f"heating = {heating * 100.0:.0f}% of the time, average load = {watts:.0f} W ({samples})")
+	
+	def menuPrintApiMetrics(self):
+		for account in list(self.accounts.values()):
+			self._printApiMetrics(account)
+	
+	def _printApiMetrics(self, account):
+		endpoints = account.client.metrics.endpoints()
+		if len(endpoints) == 0:
+			self.logger.info(f"API metrics for {account.name}: no requests yet")
+			return
+		self.logger.info(f"API metrics for {account.name}:")
+		for endpoint, metrics in endpoints.items():
+			statusCodes = ", ".join(f"{status}: {count}" for status, count in sorted(metrics['status_codes'].items()))
+			self.logger.info(f"API {endpoint}: requests = {metrics['requests']}, status codes = [{statusCodes}], timeouts = {metrics['timeouts']}, connection errors = {metrics['connection_errors']}, "
+				f"latency p50/p95/p99 = {metrics['latency_p50_ms']:.0f}/{metrics['latency_p95_ms']:.0f}/{metrics['latency_p99_ms']:.0f} ms, mean = {metrics['latency_mean_ms']:.0f} ms, response bytes = {metrics['response_bytes']}")
+	
 	def printPluginPrefs(self):
 		self.logger.debug("printPluginPrefs values: login = {}, password = {}".format(self.pluginPrefs["login"], self.pluginPrefs["password"]))
 	
@@ -469,7 +1021,8 @@ class Plugin(indigo.PluginBase):
    
 	def actionControlThermostat(self, action, device):
 		self.logger.debug(f"{device.name}: action.thermostatAction: {action.thermostatAction}, action.actionValue: {action.actionValue}, setpointHeat: {device.heatSetpoint}, setpointCool: {device.coolSetpoint}")
-		global update_needed
+		serialNumber = device.pluginProps.get("serialNumbers", False)
+		account = self._accountFor(device)
 
         ###### REQUEST STATE UPDATES ######
 		if action.thermostatAction in [ indigo.kThermostatAction.RequestStatusAll,
@@ -479,54 +1032,81 @@ class Plugin(indigo.PluginBase):
 										indigo.kThermostatAction.RequestHumidities,
 										indigo.kThermostatAction.RequestDeadbands,
 										indigo.kThermostatAction.RequestSetpoints ]:
-			update_needed = True
+			self.wakeQueue.post(WakeEvent.REFRESH_DEVICE, device.id)
 		
         ###### DECREASE/INCREASE HEAT SETPOINT ######
+		# Setpoint changes are coalesced so a burst of clicks sends one POST, see _sendCoalescedSetpoint
 		if action.thermostatAction == indigo.kThermostatAction.IncreaseHeatSetpoint:
-			self.logger.debug(f"IncreaseHeatSetpoint: actionValue = {action.actionValue}")
-			self.logger.debug(f"display_setpoint = {self.display_setpoint} tempStepSchluter = {self.temperatureFormatter.tempStepSchluter()}")
-			self.logger.debug(f"new setpoint: {self.display_setpoint} + {self.temperatureFormatter.tempStepSchluter()} = {self.display_setpoint + self.temperatureFormatter.tempStepSchluter()}")
-					
-			# TODO: Setup catch for nonexistant response
-			if self.schluter.set_temp_next_sched(self.authentication.session_id, device.pluginProps.get("serialNumbers", False), self.display_setpoint + self.temperatureFormatter.tempStepSchluter(), self.getNextScheduleTime()) is True:
-				update_needed = True
-			else:
+			self.logger.debug(f"IncreaseHeatSetpoint: actionValue = {action.actionValue}, tempStepSchluter = {self.temperatureFormatter.tempStepSchluter()}")
+			setpoint = self.commandCoalescer.adjust(device.id, self.temperatureFormatter.tempStepSchluter(), lambda: self._currentSetpoint(account, serialNumber))
+			if setpoint is None:
 				self.logger.error("Server Connection Error")
+			else:
+				self.logger.debug(f"new setpoint: {setpoint}")
 		
 		elif action.thermostatAction == indigo.kThermostatAction.DecreaseHeatSetpoint:
-			self.logger.debug(f"DecreaseHeatSetpoint: actionValue = {action.actionValue}")
-			self.logger.debug(f"display_setpoint = {self.display_setpoint} tempStepSchluter = {self.temperatureFormatter.tempStepSchluter()}")
-			self.logger.debug(f"new setpoint: {self.display_setpoint} - {self.temperatureFormatter.tempStepSchluter()} = {self.display_setpoint - self.temperatureFormatter.tempStepSchluter()}")
-
-			# TODO: Setup catch for nonexistant response
-			if self.schluter.set_temp_next_sched(self.authentication.session_id, device.pluginProps.get("serialNumbers", False), self.display_setpoint - self.temperatureFormatter.tempStepSchluter(), self.getNextScheduleTime()) is True:
-				update_needed = True
-			else:
+			self.logger.debug(f"DecreaseHeatSetpoint: actionValue = {action.actionValue}, tempStepSchluter = {self.temperatureFormatter.tempStepSchluter()}")
+			setpoint = self.commandCoalescer.adjust(device.id, -self.temperatureFormatter.tempStepSchluter(), lambda: self._currentSetpoint(account, serialNumber))
+			if setpoint is None:
 				self.logger.error("Server Connection Error")
+			else:
+				self.logger.debug(f"new setpoint: {setpoint}")
 
 		###### SET HEAT SETPOINT ######
 		elif action.thermostatAction == indigo.kThermostatAction.SetHeatSetpoint:
 			self.logger.debug(f"SetHeatSetpoint: actionValue = {action.actionValue}")
-			self.logger.debug(f"new setpoint: {self.temperatureFormatter.convertToSchluter(action.actionValue)}")
-			
-			# TODO: Setup catch for nonexistant response
-			if self.schluter.set_temp_next_sched(self.authentication.session_id, device.pluginProps.get("serialNumbers", False), self.temperatureFormatter.convertToSchluter(action.actionValue), self.getNextScheduleTime()) is True:
-				update_needed = True
-			else:
-				self.logger.error("Server Connection Error")
+			setpoint = self.commandCoalescer.set(device.id, self.temperatureFormatter.convertToSchluter(action.actionValue))
+			self.logger.debug(f"new setpoint: {setpoint}")
+
+	def _currentSetpoint(self, account, serialNumber):
+		with self.stateLock:
+			expected = self.pendingCommands.get(str(serialNumber))
+		if expected is not None and expected[1] is not None:
+			# The cached snapshot predates the last command
+			return expected[1]
+		thermostat = self._getThermostat(account, serialNumber, useCache=expected is None)
+		if thermostat is None:
+			return None
+		self.logger.debug(f"display_setpoint = {thermostat.display_setpoint}")
+		return thermostat.display_setpoint
+
+	# Called by the command coalescer once a burst of setpoint actions has settled
+	def _sendCoalescedSetpoint(self, deviceId, setpoint):
+		try:
+			device = indigo.devices[deviceId]
+		except KeyError:
+			self.logger.error(f"Device {deviceId} no longer exists, setpoint {setpoint} not sent")
+			return
+		serialNumber = device.pluginProps.get("serialNumbers", False)
+		self.logger.debug(f"{device.name}: sending setpoint {setpoint}")
+		
+		# TODO: Setup catch for nonexistant response
+		account = self._accountFor(device)
+		if account is None:
+			self.logger.error("Server Connection Error")
+			return
+		endTime = self.getNextScheduleTime(account, serialNumber)
+		if endTime is None:
+			self.logger.error(f"{device.name}: next schedule change unknown, setpoint {self.temperatureFormatter.format(setpoint)} not sent")
+			return
+		if account.client.set_temp_next_sched(account.session_id, serialNumber, setpoint, endTime) is True:
+			self._applyCommandOptimistically(device, 2, setpoint)
+		else:
+			self.logger.error("Server Connection Error")
 
 	########################################
 	# Resume Program callbacks
 	########################################
 
 	def actionResumeProgram(self, action, device):
-		global update_needed
 		self.logger.info(f"Resume Program for thermostat: {device.name}")
+		account = self._accountFor(device)
 		
 		# TODO: Setup catch for nonexistant response
-		if self.schluter.return_to_schedule(self.authentication.session_id, device.pluginProps.get("serialNumbers", False)) is False:
+		if account is None or account.client.return_to_schedule(account.session_id, device.pluginProps.get("serialNumbers", False)) is False:
 			self.logger.error("Server Connection Error")
-		update_needed = True
+		else:
+			self._applyCommandOptimistically(device, 1)
 
 	def pickThermostat(self, filter=None, valuesDict=None, typeId=0):
 		self.logger.debug("pickThermostat")
@@ -547,15 +1127,170 @@ class Plugin(indigo.PluginBase):
 		if (tempValue < 500) or (tempValue > 4000):
 				return False
 		
+		account = self._accountFor(device)
+		if account is None:
+			self.logger.error(f"{device.name}: account is not running")
+			return False
+		
 		if holdType == "nextTransition":
+			endTime = self.getNextScheduleTime(account, device.pluginProps.get("serialNumbers", False))
+			if endTime is None:
+				self.logger.error(f"{device.name}: next schedule change unknown, temperature not set")
+				return False
 			# TODO: Setup catch for nonexistant response
-			if self.schluter.set_temp_next_sched(self.authentication.session_id, device.pluginProps.get("serialNumbers", False), tempValue, self.getNextScheduleTime()) is False:
+			if account.client.set_temp_next_sched(account.session_id, device.pluginProps.get("serialNumbers", False), tempValue, endTime) is False:
 				self.logger.error("Server Connection Error")
 				return False
+			self._applyCommandOptimistically(device, 2, tempValue)
 		else:
 			# TODO: Setup catch for nonexistant response
-			if self.schluter.set_temp_permanently(self.authentication.session_id, device.pluginProps.get("serialNumbers", False), tempValue) is False:
+			if account.client.set_temp_permanently(account.session_id, device.pluginProps.get("serialNumbers", False), tempValue) is False:
 				self.logger.error("Server Connection Error")
 				return False
+			self._applyCommandOptimistically(device, 3, tempValue)
 		return True
 
+	# Pushes the regulation mode and setpoint an accepted command produces straight to the device states, instead of
+	# refreshing. The follow-up poll PollScheduler.command_sent queues for this device verifies them, see _reconcileCommand
+	def _applyCommandOptimistically(self, device, regulationMode, setpoint=None):
+		update_list = [{'key' : "regulation_mode", 'value' : regulationMode}]
+		if setpoint is not None:
+			update_list.append({'key' : "setpointHeat", 'value' : self.temperatureFormatter.convertFromSchluter(setpoint), 'uiValue' : self.temperatureFormatter.format(setpoint), 'decimalPlaces' : 1})
+		with self.stateLock:
+			self.pendingCommands[str(device.pluginProps.get("serialNumbers", ""))] = (regulationMode, setpoint)
+			self.commandStats['optimistic'] += 1
+		self._pushChangedStates(device, update_list)
+		self.pollScheduler.command_sent(device.id)
+
+	# Checks the first poll after a command against what the command should have produced. The poll's
+	# states are pushed either way, so a disagreement is corrected on the device
+	def _reconcileCommand(self, dev, thermostat):
+		with self.stateLock:
+			expected = self.pendingCommands.pop(str(thermostat.serial_number), None)
+		if expected is None:
+			return
+		regulationMode, setpoint = expected
+		if thermostat.regulation_mode == regulationMode and (setpoint is None or thermostat.display_setpoint == setpoint):
+			self.logger.debug(f"{dev.name}: server confirmed regulation mode {regulationMode}, setpoint {setpoint}")
+			with self.stateLock:
+				self.commandStats['confirmed'] += 1
+		else:
+			self.logger.warning(f"{dev.name}: server reports regulation mode {thermostat.regulation_mode} and setpoint {self.temperatureFormatter.format(thermostat.display_setpoint)} after the last command - updating")
+			with self.stateLock:
+				self.commandStats['corrected'] += 1
+
+	########################################
+	# Group and multi-device actions
+	########################################
+
+	def pickGroup(self, filter=None, valuesDict=None, typeId=0):
+		self.logger.debug("pickGroup")
+		groups = {}
+		for device in indigo.devices.iter("self.SchluterThermostat"):
+			thermostat = self.thermostatCache.peek(device.pluginProps.get("serialNumbers", ""))
+			if thermostat is not None:
+				groups[str(thermostat.group_id)] = thermostat.group_name
+		retList = list(groups.items())
+		retList.sort(key=lambda tup: tup[1])
+		return retList
+
+	def actionResumeProgramMulti(self, action):
+		def resumeProgram(account, device, serialNumber):
+			if account.client.return_to_schedule(account.session_id, serialNumber) is not True:
+				return False
+			self._applyCommandOptimistically(device, 1)
+			return True
+		
+		devices = self._actionTargets(action.props)
+		return self._dispatchToDevices(devices, "Resume Program", resumeProgram)
+
+	def actionSetTemperatureMulti(self, action):
+		try:
+			tempValue = self.temperatureFormatter.convertToSchluter(float(action.props.get("temperatureValue")))
+		except (TypeError, ValueError):
+			self.logger.error(f"Invalid temperature: {action.props.get('temperatureValue')}")
+			return False
+		holdType = action.props.get("holdType")
+		self.logger.debug(f"tempValue {tempValue}  holdType {holdType}")
+
+		if (tempValue < 500) or (tempValue > 4000):
+			self.logger.error(f"Temperature out of range: {action.props.get('temperatureValue')}")
+			return False
+		
+		def setTemperature(account, device, serialNumber):
+			if holdType == "nextTransition":
+				endTime = self.getNextScheduleTime(account, serialNumber)
+				if endTime is None:
+					self.logger.error(f"{device.name}: next schedule change unknown, temperature not set")
+					return False
+				if account.client.set_temp_next_sched(account.session_id, serialNumber, tempValue, endTime) is not True:
+					return False
+				self._applyCommandOptimistically(device, 2, tempValue)
+				return True
+			if account.client.set_temp_permanently(account.session_id, serialNumber, tempValue) is not True:
+				return False
+			self._applyCommandOptimistically(device, 3, tempValue)
+			return True
+		
+		devices = self._actionTargets(action.props)
+		return self._dispatchToDevices(devices, f"Set Temperature {self.temperatureFormatter.format(tempValue)}", setTemperature)
+
+	# The devices selected by an action's targetType, targetGroup and targetDevices fields.
+	# Group membership comes from the thermostats' last poll
+	def _actionTargets(self, props):
+		if props.get("targetType", "group") == "group":
+			groupId = str(props.get("targetGroup", ""))
+			devices = []
+			for device in indigo.devices.iter("self.SchluterThermostat"):
+				thermostat = self.thermostatCache.peek(device.pluginProps.get("serialNumbers", ""))
+				if device.enabled and thermostat is not None and str(thermostat.group_id) == groupId:
+					devices.append(device)
+			return devices
+		deviceIds = set(int(deviceId) for deviceId in props.get("targetDevices", []))
+		return [device for device in indigo.devices.iter("self.SchluterThermostat") if device.id in deviceIds and device.enabled]
+
+	# Runs command(account, device, serialNumber) for every device, at most refreshConcurrency at a time. Commands apply
+	# their result with _applyCommandOptimistically; the devices that succeeded then share one follow-up poll, which
+	# verifies them. Returns the ids of the devices that succeeded and failed
+	def _dispatchToDevices(self, devices, description, command):
+		sentAt = time.time()
+		results = {}
+		if len(devices) > 0:
+			with concurrent.futures.ThreadPoolExecutor(max_workers=min(self.refreshConcurrency, len(devices)), thread_name_prefix="SchluterCommand") as executor:
+				futures = {executor.submit(self._runDeviceCommand, command, device): device for device in devices}
+				for future in concurrent.futures.as_completed(futures):
+					device = futures[future]
+					try:
+						results[device.id] = future.result()
+					except Exception as error:
+						self.logger.error(f"{device.name}: {description} failed - {error}")
+						results[device.id] = False
+		
+		succeeded = [device for device in devices if results.get(device.id)]
+		failed = [device for device in devices if not results.get(device.id)]
+		self.logger.info(f"{description}: succeeded on {len(succeeded)} of {len(devices)} thermostats")
+		if len(failed) > 0:
+			self.logger.error(f"{description} failed on: {', '.join(sorted(device.name for device in failed))}")
+		
+		# Moves each device's follow-up to the same time, so they are refreshed together
+		for device in succeeded:
+			self.pollScheduler.command_sent(device.id, sentAt)
+		
+		succeededIds = indigo.List()
+		for device in succeeded:
+			succeededIds.append(device.id)
+		failedIds = indigo.List()
+		for device in failed:
+			failedIds.append(device.id)
+		result = indigo.Dict()
+		result["succeeded"] = succeededIds
+		result["failed"] = failedIds
+		return result
+
+	def _runDeviceCommand(self, command, device):
+		account = self._accountFor(device)
+		if account is None:
+			self.logger.error(f"{device.name}: account is not running")
+			return False
+		return command(account, device, device.pluginProps.get("serialNumbers", False))
+
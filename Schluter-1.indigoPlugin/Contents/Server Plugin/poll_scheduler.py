@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+
+import heapq
+import itertools
+import threading
+import time
+
+# Polling interval multipliers applied to the configured update frequency
+ACTIVE_FACTOR = 0.5     # heating, recently commanded, or temperature moving toward setpoint
+IDLE_FACTOR = 2.0       # none of the above
+INACTIVE_FACTOR = 3.0   # offline or in vacation mode
+
+MIN_INTERVAL = 60.0
+MAX_INTERVAL = 3600.0
+
+# Polls due within this fraction of the base interval, up to BATCH_WINDOW seconds, are made together, so
+# devices refreshed by one bulk request, and rescheduled moments apart, come due as one batch rather than
+# one by one. The window stays well short of COMMAND_FOLLOWUP and of the plugin's first refresh delay,
+# so follow-up polls and the batched first refresh are not made early
+BATCH_WINDOW = 1.0
+BATCH_WINDOW_FRACTION = 0.05
+
+# A command schedules a follow-up poll after COMMAND_FOLLOWUP seconds and keeps the device
+# at the active rate for COMMAND_WINDOW seconds
+COMMAND_FOLLOWUP = 30.0
+COMMAND_WINDOW = 900.0
+
+class PollScheduler:
+
+    # Keeps each device's next poll time in a heap. Entries are never removed from the heap in place;
+    # a key's current due time lives in _due and outdated heap entries are dropped when they surface.
+    # on_earlier() is called whenever a poll is scheduled before every other one, so a loop sleeping until
+    # next_due() can wake up
+    def __init__(self, base_interval, on_earlier=None):
+        self._base_interval = base_interval
+        self._on_earlier = on_earlier
+        self._heap = []
+        self._due = {}
+        self._last_command = {}
+        self._last_temperature = {}
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+        self._stats = { 'active': 0, 'idle': 0, 'inactive': 0 }
+
+    @property
+    def base_interval(self):
+        return self._base_interval
+
+    @base_interval.setter
+    def base_interval(self, value):
+        self._base_interval = value
+
+    def schedule(self, key, due):
+        with self._lock:
+            earlier = self._push(key, due)
+        self._notify(earlier)
+
+    # Schedules key at due unless it is already scheduled earlier
+    def schedule_by(self, key, due):
+        earlier = False
+        with self._lock:
+            current = self._due.get(key)
+            if current is None or due < current:
+                earlier = self._push(key, due)
+        self._notify(earlier)
+
+    # Schedules a retry at the base interval for a poll that failed
+    def retry(self, key, now=None):
+        self.schedule(key, (now or time.time()) + self._clamp(self._base_interval))
+
+    def remove(self, key):
+        with self._lock:
+            self._due.pop(key, None)
+            self._last_command.pop(key, None)
+            self._last_temperature.pop(key, None)
+
+    def is_scheduled(self, key):
+        with self._lock:
+            return key in self._due
+
+    # Removes and returns every key whose poll is due, or due within the batch window
+    def pop_due(self, now=None):
+        limit = (now or time.time()) + min(self._base_interval * BATCH_WINDOW_FRACTION, BATCH_WINDOW)
+        keys = []
+        with self._lock:
+            while len(self._heap) > 0 and self._heap[0][0] <= limit:
+                due, sequence, key = heapq.heappop(self._heap)
+                if self._due.get(key) == due:
+                    del self._due[key]
+                    keys.append(key)
+        return keys
+
+    # Time of the earliest scheduled poll, or None if nothing is scheduled
+    def next_due(self):
+        with self._lock:
+            return self._earliest()
+
+    def command_sent(self, key, now=None):
+        now = now or time.time()
+        with self._lock:
+            self._last_command[key] = now
+        self.schedule_by(key, now + COMMAND_FOLLOWUP)
+
+    # Schedules the next poll of key based on the thermostat snapshot it just returned
+    def reschedule(self, key, thermostat, now=None):
+        now = now or time.time()
+        interval = self.interval_for(key, thermostat, now)
+        self.schedule(key, now + interval)
+        return interval
+
+    def interval_for(self, key, thermostat, now=None):
+        now = now or time.time()
+        with self._lock:
+            previous_temperature = self._last_temperature.get(key)
+            self._last_temperature[key] = thermostat.temperature
+            recently_commanded = (now - self._last_command.get(key, 0.0)) < COMMAND_WINDOW
+
+        if not thermostat.is_online or thermostat.vacation_enabled:
+            activity = 'inactive'
+        elif recently_commanded or thermostat.is_heating or _moving_toward_setpoint(previous_temperature, thermostat):
+            activity = 'active'
+        else:
+            activity = 'idle'
+
+        factor = { 'active': ACTIVE_FACTOR, 'idle': IDLE_FACTOR, 'inactive': INACTIVE_FACTOR }[activity]
+        with self._lock:
+            self._stats[activity] += 1
+        return self._clamp(self._base_interval * factor)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['scheduled'] = len(self._due)
+            return stats
+
+    # These methods must be called with the lock held; _push returns whether due is now the earliest poll
+    def _push(self, key, due):
+        earliest = self._earliest()
+        self._due[key] = due
+        heapq.heappush(self._heap, (due, next(self._sequence), key))
+        return earliest is None or due < earliest
+
+    def _earliest(self):
+        while len(self._heap) > 0 and self._due.get(self._heap[0][2]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+        return self._heap[0][0] if len(self._heap) > 0 else None
+
+    def _notify(self, earlier):
+        if earlier and self._on_earlier is not None:
+            self._on_earlier()
+
+    def _clamp(self, interval):
+        return min(max(interval, MIN_INTERVAL), MAX_INTERVAL)
+
+def _moving_toward_setpoint(previous_temperature, thermostat):
+    if previous_temperature is None or previous_temperature == thermostat.temperature:
+        return False
+    setpoint = thermostat.display_setpoint
+    return abs(setpoint - thermostat.temperature) < abs(setpoint - previous_temperature)
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import threading
+
+class ResponseFingerprints:
+
+    # Digest of the last response body per key - a thermostat's serial number, or an account's bulk
+    # response - together with what was decoded from it. A body identical to the previous one hands
+    # back that value, so the caller can skip decoding it again
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._stats = { 'hits': 0, 'misses': 0, 'bytes_skipped': 0 }
+
+    # Returns (fingerprint, value), where value is None unless the body matches the last one stored for key
+    def lookup(self, key, content):
+        fingerprint = hashlib.blake2b(content, digest_size=16).digest()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == fingerprint:
+                self._stats['hits'] += 1
+                self._stats['bytes_skipped'] += len(content)
+                return fingerprint, entry[1]
+            self._stats['misses'] += 1
+            return fingerprint, None
+
+    def store(self, key, fingerprint, value):
+        with self._lock:
+            self._entries[key] = (fingerprint, value)
+
+    def evict(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+            return stats
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+
+from bisect import bisect_right
+from datetime import datetime, timedelta
+
+SECONDS_PER_DAY = 24 * 60 * 60
+SECONDS_PER_WEEK = 7 * SECONDS_PER_DAY
+END_TIME_FORMAT = "%d/%m/%Y %H:%M:%S +00:00"
+
+class ScheduleIndex:
+
+    # Compiles a thermostat's weekly Schedules into a sorted list of active event times, stored as
+    # seconds from Monday 00:00 local time, so the next transition is a binary search
+    def __init__(self, schedules, tzoffset):
+        self._schedules = schedules
+        self._tzoffset = tzoffset
+        self._utcoffset = datetime.strptime(tzoffset, "%z").utcoffset()
+
+        offsets = set()
+        for weekday, schedule in enumerate(schedules):
+            for event in schedule["Events"]:
+                if event["Active"]:
+                    clock = datetime.strptime(event["Clock"], "%H:%M:%S").time()
+                    offsets.add(weekday * SECONDS_PER_DAY + clock.hour * 3600 + clock.minute * 60 + clock.second)
+        self._offsets = sorted(offsets)
+
+    @property
+    def offsets(self):
+        return self._offsets
+
+    # True if the index was built from this schedule payload, so it doesn't need rebuilding
+    def matches(self, schedules, tzoffset):
+        return tzoffset == self._tzoffset and (schedules is self._schedules or schedules == self._schedules)
+
+    # Returns the UTC time of the next active schedule event after now, formatted for ComfortEndTime
+    def next_schedule_time(self, now=None):
+        # Convert from UTC to local time
+        current_datetime = (now or datetime.utcnow()).replace(microsecond = 0) + self._utcoffset
+        current_offset = current_datetime.weekday() * SECONDS_PER_DAY + current_datetime.hour * 3600 + current_datetime.minute * 60 + current_datetime.second
+
+        # This should never trigger unless there are no active schedule times; use the current time as a failsafe
+        if len(self._offsets) == 0:
+            return (current_datetime - self._utcoffset).strftime(END_TIME_FORMAT)
+
+        position = bisect_right(self._offsets, current_offset)
+        if position < len(self._offsets):
+            delta = self._offsets[position] - current_offset
+        else:
+            # Wrap around to the first event of the week
+            delta = self._offsets[0] + SECONDS_PER_WEEK - current_offset
+
+        # Re-convert back to UTC
+        end_datetime = current_datetime + timedelta(seconds = delta) - self._utcoffset
+        return end_datetime.strftime(END_TIME_FORMAT)
@@ -1,14 +1,13 @@
 # -*- coding: utf-8 -*-
 
-from ensurepip import version
-import json
 import logging
-import indigo
-from requests import request, Session
+from requests import request
 import threading
+import time
 import requests
-import temperature_scale
 from schluter_thermo import Schluter_Thermo
+from http_pool import HttpPool, DEFAULT_POOL_SIZE, DEFAULT_IDLE_TIMEOUT
+from api_metrics import ApiMetrics
 
 # URL Constants
 API_BASE_URL = "https://ditra-heat-e-wifi.schluter.com"
@@ -18,16 +17,88 @@ API_GET_THERMOSTATS_URL = API_BASE_URL + "/api/thermostats"
 API_SET_TEMPERATURE_URL = API_BASE_URL + "/api/thermostat"
 API_APPLICATION_ID = 7
 
+# After a failed re-authentication, requests rejected with the same session don't retry the login for this long
+RENEWAL_BACKOFF = 60.0
+
+# Flattens the Groups/Thermostats structure returned by API_GET_THERMOSTATS_URL
+def thermostats_from_groups(data):
+    thermostat_list = []
+    for group in data["Groups"]:
+        for thermostat in group["Thermostats"]:
+            thermostat_list.append(Schluter_Thermo(thermostat))
+    return thermostat_list
+
+# Label used for the per-endpoint request metrics
+def endpoint_name(method, url):
+    if url == API_AUTH_URL:
+        return "auth"
+    if url.startswith(API_USERACCOUNT_URL):
+        return "useraccount"
+    if url == API_GET_THERMOSTATS_URL:
+        return "thermostats"
+    if url == API_SET_TEMPERATURE_URL:
+        return "thermostat " + method.upper()
+    return url
+
+# Authentication.session_id is a 1-tuple, but either form may be passed in as sessionId
+def session_key(session_id):
+    if isinstance(session_id, (list, tuple)):
+        return session_id[0] if len(session_id) > 0 else None
+    return session_id
+
 class Schluter:
 
 #    temperatureFormatter = temperature_scale.Celsius()
     
-    def __init__(self, timeout=10, command_timeout=60):
+    def __init__(self, timeout=10, command_timeout=60, pool_size=DEFAULT_POOL_SIZE, idle_timeout=DEFAULT_IDLE_TIMEOUT):
         self._timeout = timeout
         self._command_timeout = command_timeout
-        self._http_session = None
+        self._http_session = HttpPool(pool_size, idle_timeout)
+        # Set when the server rejects the session ID and it couldn't be renewed; cleared by the plugin once it has re-authenticated
+        self.auth_update_needed = False
+        self._reauthenticate = None
+        self._session_id = None
+        self._session_lock = threading.Lock()
+        self._renewal_done = threading.Condition(self._session_lock)
+        self._renewing = False
+        self._renewal_failed = None
+        self._renewal_failed_at = 0.0
+        self._auth_stats = { 'renewals': 0, 'replays': 0 }
+        self.metrics = ApiMetrics()
         self.logger = logging.getLogger("Plugin.Schluter")
 
+    # reauthenticate() logs in again and returns the new session ID, or None if it failed
+    def set_reauthenticator(self, reauthenticate):
+        self._reauthenticate = reauthenticate
+
+    # Tells the client which session ID is current, e.g. after the plugin's periodic authentication
+    def set_session(self, session_id):
+        with self._session_lock:
+            self._session_id = session_id
+
+    def auth_stats(self):
+        with self._session_lock:
+            return dict(self._auth_stats)
+
+    # Connection pool lifecycle - follows Plugin.startup/shutdown
+    def open(self):
+        self._http_session.open()
+
+    def close(self):
+        self._http_session.close()
+
+    def set_pool_size(self, pool_size):
+        self._http_session.resize(pool_size)
+
+    def reap_idle_connections(self):
+        return self._http_session.reap_idle()
+
+    def idle_connection_deadline(self):
+        return self._http_session.idle_deadline()
+
+    def connection_stats(self):
+        return self._http_session.stats()
+
     def get_session(self, email, password):
         self.logger.debug("get_session called")
         response = self._call_api(
@@ -44,22 +115,20 @@ class Schluter:
 
     def get_thermostats(self, sessionId):
         self.logger.debug("get_thermostats called")
-        params = { 'sessionId': sessionId }
-        result = self._call_api("get", API_GET_THERMOSTATS_URL, params)
+        result = self.get_thermostat_groups(sessionId)
         
         if result is not None:
-            thermostats = result.json()
-            groups = thermostats["Groups"]
-
-            thermostat_list = []
-            for group in groups:
-                for thermostat in group["Thermostats"]:
-                    thermostat_list.append(Schluter_Thermo(thermostat))
-            
-            return thermostat_list
+            return thermostats_from_groups(result.json())
         else:
             return None
     
+    # The undecoded response to API_GET_THERMOSTATS_URL, for callers that look at the body before parsing it
+    def get_thermostat_groups(self, sessionId):
+        params = { 'sessionId': sessionId }
+        result = self._call_api("get", API_GET_THERMOSTATS_URL, params)
+        
+        return result
+    
     def get_thermostat(self, sessionId, serialNumber):
         self.logger.debug("get_temperature called")
         params = { 'sessionId': sessionId, 'serialnumber': serialNumber }
@@ -100,10 +169,40 @@ class Schluter:
         else:
             return False
 
-    # This method will return a None object if there is a connection error
-    def _call_api(self, method, url, params, **kwargs):
-        global auth_update_needed
-        
+    # Single-flight session renewal: the first request rejected with a session logs in again while
+    # concurrent requests rejected with the same session wait for it and reuse the new session.
+    # The lock is released during the login, since the reauthenticator may call set_session
+    def _renew_session(self, params):
+        if self._reauthenticate is None or params is None or "sessionId" not in params:
+            return None
+        rejected = session_key(params["sessionId"])
+        with self._session_lock:
+            while self._renewing:
+                self._renewal_done.wait()
+            if self._session_id is not None and session_key(self._session_id) != rejected:
+                return self._session_id
+            if self._renewal_failed == rejected and (time.time() - self._renewal_failed_at) < RENEWAL_BACKOFF:
+                return None
+            self.logger.info("Session rejected - re-authenticating")
+            self._auth_stats['renewals'] += 1
+            self._renewing = True
+        session_id = None
+        try:
+            session_id = self._reauthenticate()
+        finally:
+            with self._session_lock:
+                self._renewing = False
+                if session_id is None:
+                    self._renewal_failed = rejected
+                    self._renewal_failed_at = time.time()
+                else:
+                    self._session_id = session_id
+                self._renewal_done.notify_all()
+        return session_id
+
+    # This method will return a None object if there is a connection error.
+    # A request rejected with 401 is replayed once with a renewed session
+    def _call_api(self, method, url, params, replay = True, **kwargs):
         payload = kwargs.get("params") or kwargs.get("json")
 
         if "timeout" not in kwargs:
@@ -111,24 +210,35 @@ class Schluter:
         
         self.logger.debug(f"Calling {str(url)} with params {str(params)} and payload={str(payload)}")
 
+        endpoint = endpoint_name(method, url)
+        serial_number = params.get("serialnumber") if params is not None else None
+        started = time.perf_counter()
         try:
             response = self._http_session.request(method, url, params = params, **kwargs) if\
                 self._http_session is not None else\
                 request(method, url, params = params, **kwargs)
         except requests.RequestException as error:
+            self.metrics.record_failure(endpoint, serial_number, (time.perf_counter() - started) * 1000.0, isinstance(error, requests.Timeout))
             self.logger.error("Connection Error - Unable to connect - {}".format(error))
             return None
         
         if response is not None:
+            self.metrics.record_response(endpoint, serial_number, response.status_code, (time.perf_counter() - started) * 1000.0, len(response.content))
             # These won't work if response doesn't exist
             if response.status_code == requests.codes.ok:
                 self.logger.debug("Response OK")
             else:
                 self.logger.error("Response Error: {}".format(response.status_code))
                 if response.status_code == 401 :
-                    auth_update_needed =  True
                     self.logger.error("Authetication Error - will re-authenticate")
-                    self.logger.error(f"auth_update_needed: {auth_update_needed}")
+                    session_id = self._renew_session(params) if replay else None
+                    if session_id is not None:
+                        self.logger.debug("Replaying request with renewed session")
+                        with self._session_lock:
+                            self._auth_stats['replays'] += 1
+                        return self._call_api(method, url, dict(params, sessionId = session_id), replay = False, **kwargs)
+                    self.auth_update_needed =  True
+                    self.logger.error(f"auth_update_needed: {self.auth_update_needed}")
                 return None
 
             self.logger.debug(f"API Response received: {str(response.status_code)} - {str(response.content)}")
@@ -1,6 +1,29 @@
 # -*- coding: utf-8 -*-
 
+# A thermostat's weekly schedule rarely changes, so each Schedules payload is compared with the one in the
+# same thermostat's previous snapshot and reused if equal. Snapshots of a thermostat then share one copy,
+# and ScheduleIndex.matches finds the schedule unchanged by identity. A dict lookup and store are atomic,
+# so no lock is needed; at worst a race misses one chance to share
+_previous_schedules = {}
+
+def _share_schedules(serial_number, schedules):
+    previous = _previous_schedules.get(serial_number)
+    if previous is not None and (previous is schedules or previous == schedules):
+        return previous
+    _previous_schedules[serial_number] = schedules
+    return schedules
+
 class Schluter_Thermo():
+    # Read-only snapshot of one thermostat from the decoded JSON response
+    __slots__ = (
+        "_serial_number", "_name", "_group_id", "_group_name", "_temperature", "_set_point_temp",
+        "_regulation_mode", "_vacation_enabled", "_vacation_begin_day", "_vacation_end_day",
+        "_vacation_temperature", "_comfort_temperature", "_comfort_end_time", "_manual_temp",
+        "_is_online", "_is_heating", "_early_start_of_heating", "_max_temp", "_min_temp",
+        "_error_code", "_tzoffset", "_kwh_charge", "_load_measured_watt", "_sw_version",
+        "_schedules",
+    )
+
     def __init__(self, data):
         self._serial_number = data["SerialNumber"]
         self._name = data["Room"]
@@ -26,8 +49,7 @@ class Schluter_Thermo():
         self._kwh_charge = data["KwhCharge"]
         self._load_measured_watt = data["LoadMeasuredWatt"]
         self._sw_version = data["SWVersion"]
-        self._display_setpoint = 1
-        self._schedules = data["Schedules"]
+        self._schedules = _share_schedules(self._serial_number, data["Schedules"])
     
     @property
     def serial_number(self):
@@ -128,15 +150,16 @@ class Schluter_Thermo():
     @property
     def display_setpoint(self):
         if self._regulation_mode == 1 :
-            self._display_setpoint = self._set_point_temp
+            return self._set_point_temp
         elif self._regulation_mode == 2 :
-            self._display_setpoint = self._comfort_temperature
+            return self._comfort_temperature
         elif self._regulation_mode == 3 :
-            self._display_setpoint = self._manual_temp
+            return self._manual_temp
         elif self._regulation_mode == 4 :
-            self._display_setpoint = self._vacation_temperature
-        return self._display_setpoint
+            return self._vacation_temperature
+        return 1
 
+    # Shared between snapshots with an equal schedule - treat it as read-only
     @property
     def schedules(self):
         return self._schedules
@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+from array import array
+
+# Readings recorded on every poll, with the array typecode used for the raw samples
+FIELDS = (
+    ("temperature", "i"),
+    ("set_point_temp", "i"),
+    ("load_measured_watt", "i"),
+    ("kwh_charge", "f"),
+    ("is_heating", "b"),
+)
+FIELD_NAMES = tuple(name for name, typecode in FIELDS)
+
+# Raw samples kept per thermostat, then the downsampled tiers as (name, bucket seconds, buckets kept)
+RAW_CAPACITY = 2880
+TIERS = (
+    ("5min", 300, 2016),
+    ("hourly", 3600, 2160),
+)
+
+class TelemetryRing:
+
+    # Fixed-capacity ring of timestamped rows stored column by column in typed arrays, so the memory is
+    # allocated once and a sample costs no Python objects. When full, the oldest row is overwritten.
+    # Weighted rings also keep the number of raw samples behind each row
+    def __init__(self, capacity, typecodes, weighted=False):
+        self.capacity = capacity
+        self.times = _zeros('d', capacity)
+        self.columns = [_zeros(typecode, capacity) for typecode in typecodes]
+        self.weights = _zeros('I', capacity) if weighted else None
+        self.size = 0
+        self._next = 0
+
+    def append(self, timestamp, values, weight=1):
+        index = self._next
+        self.times[index] = timestamp
+        for column, value in zip(self.columns, values):
+            column[index] = value
+        if self.weights is not None:
+            self.weights[index] = weight
+        self._next = (index + 1) % self.capacity
+        if self.size < self.capacity:
+            self.size += 1
+
+    def oldest(self):
+        return self.times[self._physical(0)] if self.size > 0 else None
+
+    def newest(self):
+        return self.times[self._physical(self.size - 1)] if self.size > 0 else None
+
+    # Rows with start <= time < end as (times, values, weights) arrays; weights is None for an unweighted ring
+    def slice(self, column, start, end):
+        first = self._lower_bound(start)
+        last = self._lower_bound(end)
+        weights = self._copy(self.weights, first, last) if self.weights is not None else None
+        return self._copy(self.times, first, last), self._copy(self.columns[column], first, last), weights
+
+    def nbytes(self):
+        arrays = [self.times] + self.columns + ([self.weights] if self.weights is not None else [])
+        return sum(data.itemsize * len(data) for data in arrays)
+
+    def _physical(self, position):
+        return (self._next - self.size + position) % self.capacity
+
+    # First position, oldest first, whose timestamp is >= timestamp
+    def _lower_bound(self, timestamp):
+        low, high = 0, self.size
+        while low < high:
+            middle = (low + high) // 2
+            if self.times[self._physical(middle)] < timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    # Copies positions first..last-1, which is at most two slices of the underlying array
+    def _copy(self, data, first, last):
+        if first >= last:
+            return data[0:0]
+        begin = self._physical(first)
+        end = begin + (last - first)
+        if end <= self.capacity:
+            return data[begin:end]
+        return data[begin:] + data[:end - self.capacity]
+
+class _Bucket:
+    __slots__ = ("start", "sums", "count")
+
+    def __init__(self):
+        self.start = None
+        self.sums = [0.0] * len(FIELDS)
+        self.count = 0
+
+class _ThermostatTelemetry:
+
+    def __init__(self, raw_capacity, tiers):
+        self.raw = TelemetryRing(raw_capacity, [typecode for name, typecode in FIELDS])
+        # Downsampled rings hold the mean of each bucket; is_heating becomes the fraction of samples heating
+        self.tiers = [(name, seconds, TelemetryRing(capacity, ['f'] * len(FIELDS), weighted=True), _Bucket()) for name, seconds, capacity in tiers]
+        self.last_timestamp = 0.0
+
+    def record(self, timestamp, values):
+        # Keep the rings sorted by time even if the clock steps back
+        timestamp = max(timestamp, self.last_timestamp)
+        self.last_timestamp = timestamp
+        self.raw.append(timestamp, values)
+        for name, seconds, ring, bucket in self.tiers:
+            start = timestamp - (timestamp % seconds)
+            if bucket.start is not None and start != bucket.start:
+                ring.append(bucket.start, [total / bucket.count for total in bucket.sums], bucket.count)
+                bucket.sums = [0.0] * len(FIELDS)
+                bucket.count = 0
+            bucket.start = start
+            for index, value in enumerate(values):
+                bucket.sums[index] += value
+            bucket.count += 1
+
+class TelemetryBuffer:
+
+    # Per-thermostat history of the polled readings in FIELDS. Every poll goes into a raw ring and is
+    # folded into 5-minute and hourly means, so memory is fixed per thermostat however long it runs.
+    # Queries pick the finest tier that still reaches back to the start of the window
+    def __init__(self, raw_capacity=RAW_CAPACITY, tiers=TIERS):
+        self._raw_capacity = raw_capacity
+        self._tiers = tiers
+        self._thermostats = {}
+        self._lock = threading.Lock()
+        self._samples = 0
+
+    def record(self, thermostat, timestamp=None):
+        values = (
+            thermostat.temperature or 0,
+            thermostat.set_point_temp or 0,
+            thermostat.load_measured_watt or 0,
+            thermostat.kwh_charge or 0.0,
+            1 if thermostat.is_heating else 0,
+        )
+        self.record_values(thermostat.serial_number, timestamp or time.time(), values)
+
+    def record_values(self, serial_number, timestamp, values):
+        with self._lock:
+            telemetry = self._thermostats.get(str(serial_number))
+            if telemetry is None:
+                telemetry = _ThermostatTelemetry(self._raw_capacity, self._tiers)
+                self._thermostats[str(serial_number)] = telemetry
+            telemetry.record(timestamp, values)
+            self._samples += 1
+
+    # Returns (resolution, times, values) for one field between start and end (default now), as arrays.
+    # Downsampled resolutions include the bucket still being filled
+    def series(self, serial_number, field, start, end=None):
+        resolution, times, values, weights = self._series(serial_number, field, start, end)
+        return resolution, times, values
+
+    def last_hours(self, serial_number, field, hours):
+        return self.series(serial_number, field, time.time() - hours * 3600.0)
+
+    # Mean of one field between start and end, weighting downsampled buckets by their sample count; None if there is no data
+    def average(self, serial_number, field, start, end=None):
+        resolution, times, values, weights = self._series(serial_number, field, start, end)
+        if len(values) == 0:
+            return None
+        if weights is None:
+            return sum(values) / len(values)
+        return sum(value * weight for value, weight in zip(values, weights)) / sum(weights)
+
+    def serial_numbers(self):
+        with self._lock:
+            return list(self._thermostats.keys())
+
+    def evict(self, serial_number):
+        with self._lock:
+            self._thermostats.pop(str(serial_number), None)
+
+    # Drops the history of every thermostat whose serial number is not in serial_numbers
+    def retain(self, serial_numbers):
+        keep = set(str(serial_number) for serial_number in serial_numbers)
+        with self._lock:
+            for serial_number in [key for key in self._thermostats if key not in keep]:
+                del self._thermostats[serial_number]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'thermostats': len(self._thermostats),
+                'samples': self._samples,
+                'bytes': sum(telemetry.raw.nbytes() + sum(ring.nbytes() for name, seconds, ring, bucket in telemetry.tiers) for telemetry in self._thermostats.values()),
+            }
+
+    def _series(self, serial_number, field, start, end):
+        column = FIELD_NAMES.index(field)
+        end = end if end is not None else float("inf")
+        with self._lock:
+            telemetry = self._thermostats.get(str(serial_number))
+            if telemetry is None:
+                return "raw", array('d'), array('d'), None
+            oldest = telemetry.raw.oldest()
+            if oldest is not None and (oldest <= start or telemetry.raw.size < telemetry.raw.capacity):
+                times, values, weights = telemetry.raw.slice(column, start, end)
+                return "raw", times, values, None
+            for index, (name, seconds, ring, bucket) in enumerate(telemetry.tiers):
+                oldest = ring.oldest()
+                covers = oldest is not None and oldest <= start
+                if covers or ring.size < ring.capacity or index == len(telemetry.tiers) - 1:
+                    times, values, weights = ring.slice(column, start, end)
+                    if bucket.count > 0 and start < bucket.start + seconds and bucket.start < end:
+                        times.append(bucket.start)
+                        values.append(bucket.sums[column] / bucket.count)
+                        weights.append(bucket.count)
+                    return name, times, values, weights
+
+def _zeros(typecode, length):
+    return array(typecode, bytes(array(typecode).itemsize * length))
@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+
+FILE_SUFFIX = ".tlm"
+MAGIC = b"SCHTLM01"
+# magic, record size, capacity, next slot, records written; padded to HEADER_SIZE
+HEADER = struct.Struct("<8sIIQQ")
+HEADER_SIZE = 64
+# timestamp, temperature, setpoint (C x 100), load watts, kWh charge, heating, regulation mode
+RECORD = struct.Struct("<dhhifBB2x")
+RECORD_FIELDS = ("timestamp", "temperature", "set_point_temp", "load_measured_watt", "kwh_charge", "is_heating", "regulation_mode")
+
+DEFAULT_RETENTION_DAYS = 30
+# Polls are at least a minute apart, so files are sized for one record a minute over the retention period
+RECORDS_PER_DAY = 1440
+
+class TelemetryFile:
+
+    # One thermostat's history: a header followed by a ring of fixed-size records in a memory-mapped file.
+    # Appending packs one record in place and updates the header, and reopening after a restart reads
+    # only the header. A file created with a different capacity is rewritten, keeping the newest records
+    def __init__(self, path, capacity):
+        self._path = path
+        self.capacity = capacity
+        self._file = None
+        self._map = None
+        self._next = 0
+        self._written = 0
+        self._open()
+
+    @property
+    def size(self):
+        return min(self._written, self.capacity)
+
+    @property
+    def nbytes(self):
+        return HEADER_SIZE + self.capacity * RECORD.size
+
+    def append(self, timestamp, temperature, setpoint, watts, kwh, heating, mode):
+        RECORD.pack_into(self._map, HEADER_SIZE + self._next * RECORD.size, timestamp, temperature, setpoint, watts, kwh, heating, mode)
+        self._next = (self._next + 1) % self.capacity
+        self._written += 1
+        self._write_header()
+
+    def newest(self):
+        return self._timestamp(self.size - 1) if self.size > 0 else None
+
+    # Positions, oldest first, of the records with start <= timestamp < end
+    def range(self, start, end):
+        return self._lower_bound(start), self._lower_bound(end)
+
+    # Unpacks records straight from the mapping, without reading the file into memory
+    def read(self, position):
+        return RECORD.unpack_from(self._map, HEADER_SIZE + self._physical(position) * RECORD.size)
+
+    def flush(self):
+        self._map.flush()
+
+    def close(self):
+        if self._map is not None:
+            self._map.flush()
+            self._map.close()
+            self._file.close()
+            self._map = None
+            self._file = None
+
+    def _open(self):
+        existing = os.path.exists(self._path)
+        fd = os.open(self._path, os.O_RDWR | os.O_CREAT, 0o600)
+        self._file = os.fdopen(fd, "r+b")
+        header = self._file.read(HEADER.size) if existing else b""
+        if len(header) == HEADER.size:
+            magic, record_size, capacity, next_slot, written = HEADER.unpack(header)
+            if magic == MAGIC and record_size == RECORD.size and next_slot < capacity and os.fstat(fd).st_size == HEADER_SIZE + capacity * RECORD.size:
+                self._map = mmap.mmap(fd, HEADER_SIZE + capacity * RECORD.size)
+                self._next = next_slot
+                self._written = written
+                if capacity != self.capacity:
+                    self._resize(capacity)
+                return
+            logging.getLogger("Plugin.TelemetryStore").warning(f"Replacing unreadable telemetry file {os.path.basename(self._path)}")
+        self._file.truncate(HEADER_SIZE + self.capacity * RECORD.size)
+        self._map = mmap.mmap(fd, HEADER_SIZE + self.capacity * RECORD.size)
+        self._next = 0
+        self._written = 0
+        self._write_header()
+
+    # Rewrites the open file, currently holding capacity records, to self.capacity records
+    def _resize(self, capacity):
+        new_capacity = self.capacity
+        self.capacity = capacity
+        keep = min(self.size, new_capacity)
+        offsets = [HEADER_SIZE + self._physical(position) * RECORD.size for position in range(self.size - keep, self.size)]
+        records = [self._map[offset:offset + RECORD.size] for offset in offsets]
+        self._map.close()
+        self._file.truncate(HEADER_SIZE + new_capacity * RECORD.size)
+        self._map = mmap.mmap(self._file.fileno(), HEADER_SIZE + new_capacity * RECORD.size)
+        for slot, record in enumerate(records):
+            self._map[HEADER_SIZE + slot * RECORD.size:HEADER_SIZE + (slot + 1) * RECORD.size] = record
+        self.capacity = new_capacity
+        self._next = keep % new_capacity
+        self._written = keep
+        self._write_header()
+
+    def _write_header(self):
+        HEADER.pack_into(self._map, 0, MAGIC, RECORD.size, self.capacity, self._next, self._written)
+
+    def _physical(self, position):
+        return (self._next - self.size + position) % self.capacity
+
+    def _timestamp(self, position):
+        return struct.unpack_from("<d", self._map, HEADER_SIZE + self._physical(position) * RECORD.size)[0]
+
+    def _lower_bound(self, timestamp):
+        low, high = 0, self.size
+        while low < high:
+            middle = (low + high) // 2
+            if self._timestamp(middle) < timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+class TelemetryStore:
+
+    # Per-thermostat telemetry files that survive plugin restarts. Each poll appends one fixed-size record;
+    # records older than retention_days are no longer returned and are overwritten as the file wraps.
+    # A retention of 0 turns the store off, and so does close()
+    def __init__(self, folder, retention_days=DEFAULT_RETENTION_DAYS):
+        self._folder = folder
+        self._retention_days = retention_days
+        self._files = {}
+        self._lock = threading.Lock()
+        self._closed = False
+        self._appends = 0
+        self.logger = logging.getLogger("Plugin.TelemetryStore")
+
+    @property
+    def retention_days(self):
+        return self._retention_days
+
+    # Open files are closed and get resized to the new retention the next time they are written
+    @retention_days.setter
+    def retention_days(self, value):
+        with self._lock:
+            if value == self._retention_days:
+                return
+            self._retention_days = value
+            self._close_files()
+
+    def append(self, thermostat, timestamp=None):
+        if self._retention_days <= 0:
+            return
+        with self._lock:
+            if self._closed:
+                return
+            telemetry_file = self._file_for(thermostat.serial_number)
+            if telemetry_file is None:
+                return
+            timestamp = max(timestamp or time.time(), telemetry_file.newest() or 0.0)
+            telemetry_file.append(
+                timestamp,
+                _int16(thermostat.temperature),
+                _int16(thermostat.set_point_temp),
+                int(thermostat.load_measured_watt or 0),
+                float(thermostat.kwh_charge or 0.0),
+                1 if thermostat.is_heating else 0,
+                int(thermostat.regulation_mode or 0) & 0xFF,
+            )
+            self._appends += 1
+
+    # Yields (timestamp, temperature, set_point_temp, load_measured_watt, kwh_charge, is_heating, regulation_mode)
+    # tuples, oldest first, for start <= timestamp < end within the retention period
+    def records(self, serial_number, start, end=None):
+        if self._retention_days <= 0:
+            return
+        with self._lock:
+            if self._closed:
+                return
+            telemetry_file = self._file_for(serial_number, create=False)
+            if telemetry_file is None:
+                return
+            start = max(start, time.time() - self._retention_days * 86400.0)
+            first, last = telemetry_file.range(start, end if end is not None else float("inf"))
+        for position in range(first, last):
+            with self._lock:
+                if telemetry_file._map is None:
+                    return
+                record = telemetry_file.read(position)
+            yield record
+
+    # Mean of each field over the records records() returns, with 'records' set to how many there were; None if there are none
+    def averages(self, serial_number, start, end=None):
+        totals = [0.0] * (len(RECORD_FIELDS) - 1)
+        count = 0
+        for record in self.records(serial_number, start, end):
+            for index, value in enumerate(record[1:]):
+                totals[index] += value
+            count += 1
+        if count == 0:
+            return None
+        averages = { name: total / count for name, total in zip(RECORD_FIELDS[1:], totals) }
+        averages['records'] = count
+        return averages
+
+    def flush(self):
+        with self._lock:
+            for telemetry_file in self._files.values():
+                telemetry_file.flush()
+
+    # Later appends are dropped, e.g. from refreshes still running at shutdown
+    def close(self):
+        with self._lock:
+            self._closed = True
+            self._close_files()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'files': len(self._files),
+                'appends': self._appends,
+                'bytes': sum(telemetry_file.nbytes for telemetry_file in self._files.values()),
+            }
+
+    # Must be called with the lock held
+    def _file_for(self, serial_number, create=True):
+        serial_number = str(serial_number)
+        telemetry_file = self._files.get(serial_number)
+        if telemetry_file is not None:
+            return telemetry_file
+        path = os.path.join(self._folder, re.sub(r"[^A-Za-z0-9_-]", "_", serial_number) + FILE_SUFFIX)
+        if not create and not os.path.exists(path):
+            return None
+        try:
+            os.makedirs(self._folder, mode=0o700, exist_ok=True)
+            telemetry_file = TelemetryFile(path, max(self._retention_days, 1) * RECORDS_PER_DAY)
+        except (OSError, ValueError) as error:
+            self.logger.error(f"Unable to open telemetry file for {serial_number} - {error}")
+            return None
+        self._files[serial_number] = telemetry_file
+        return telemetry_file
+
+    # Must be called with the lock held
+    def _close_files(self):
+        for telemetry_file in self._files.values():
+            telemetry_file.close()
+        self._files = {}
+
+def _int16(value):
+    return min(max(int(value or 0), -32768), 32767)
@@ -1,20 +1,71 @@
 # -*- coding: utf-8 -*-
  
+from array import array
+
 FORMAT_STRING = "{0:.1f}"
 
+# Readings covered by the lookup tables, in Schluter units (C x 100); anything outside is converted directly
+TABLE_MIN_READING = -2000
+TABLE_MAX_READING = 6000
+TABLE_OFFSET = -TABLE_MIN_READING
+
 class TemperatureScale:
 
+	# Every reading in the table range is converted and formatted once, so conversions are index lookups
+	def __init__(self):
+		values = array('d')
+		uiValues = []
+		formatted = {}
+		for reading in range(TABLE_MIN_READING, TABLE_MAX_READING + 1):
+			value = self.computeFromSchluter(reading)
+			values.append(value)
+			if value not in formatted:
+				formatted[value] = self.computeFormat(reading)
+			uiValues.append(formatted[value])
+		self._values = values
+		self._uiValues = uiValues
+
 	def report(self, dev, stateKey, reading):
 		dev.updateStateOnServer(key=stateKey, value=self.convertFromSchluter(reading), decimalPlaces=1, uiValue=self.format(reading))
 		return
+	
+	def convertFromSchluter(self, reading):
+		if type(reading) is int and TABLE_MIN_READING <= reading <= TABLE_MAX_READING:
+			return self._values[reading + TABLE_OFFSET]
+		return self.computeFromSchluter(reading)
 		
 	def format(self, reading):
-		return u"%s%s" % (FORMAT_STRING.format(self.convertFromSchluter(reading)), self.suffix())
+		if type(reading) is int and TABLE_MIN_READING <= reading <= TABLE_MAX_READING:
+			return self._uiValues[reading + TABLE_OFFSET]
+		return self.computeFormat(reading)
+	
+	def computeFormat(self, reading):
+		return u"%s%s" % (FORMAT_STRING.format(self.computeFromSchluter(reading)), self.suffix())
+	
+	# Batch versions for history and export: convert a whole sequence of readings (a list, or an array
+	# from the telemetry buffers) in one call. convertManyFromSchluter returns an array('d')
+	def convertManyFromSchluter(self, readings):
+		return array('d', self._lookupMany(self._values, readings, self.computeFromSchluter))
+	
+	def formatMany(self, readings):
+		return self._lookupMany(self._uiValues, readings, self.computeFormat)
+	
+	def _lookupMany(self, table, readings, compute):
+		if not isinstance(readings, (list, tuple, array)):
+			readings = list(readings)
+		try:
+			# Negative indexes would wrap around, so only the low end of the table needs checking up front
+			if len(readings) == 0 or min(readings) >= TABLE_MIN_READING:
+				return [table[reading + TABLE_OFFSET] for reading in readings]
+		except (IndexError, TypeError):
+			# A reading above the table or a non-integer reading - convert them one at a time
+			pass
+		return [table[reading + TABLE_OFFSET] if type(reading) is int and TABLE_MIN_READING <= reading <= TABLE_MAX_READING else compute(reading) for reading in readings]
 
 class Fahrenheit(TemperatureScale):
 
-	# convertFromSchluter() methods input the Schuter temperature value (convert to C x 100) and output the rounded to the nearest 0.5 converted value for the class
-	def convertFromSchluter(self, reading):
+	# computeFromSchluter() methods input the Schuter temperature value (convert to C x 100) and output the rounded to the nearest 0.5 converted value for the class
+	def computeFromSchluter(self, reading):
 		return round(((((reading / 100.0) * 9.0) / 5.0) + 32.0) * 2.0) / 2.0
 		
 	# convertToSchluter() methods input the temperature value in the current scale and output the Schluter value int(convert to C x 100)
@@ -32,8 +83,8 @@ class Fahrenheit(TemperatureScale):
 
 class Celsius(TemperatureScale):
 
-	# convertFromSchluter() methods input the Schuter temperature value (C x 100) and output the rounded to the nearest 0.5 converted value for the class
-	def convertFromSchluter(self, reading):
+	# computeFromSchluter() methods input the Schuter temperature value (C x 100) and output the rounded to the nearest 0.5 converted value for the class
+	def computeFromSchluter(self, reading):
 		return round((reading / 100.0) * 2.0) / 2.0
 		
 	# convertToSchluter() methods input the temperature value in the current scale and output the Schluter value int(C x 100)
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+
+DEFAULT_TTL = 120.0
+
+class ThermostatCache:
+
+    # Latest Schluter_Thermo snapshot per serial number. Entries older than ttl seconds are
+    # treated as stale by get(), so callers can refresh them lazily
+    def __init__(self, ttl=DEFAULT_TTL):
+        self._ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._stats = { 'hits': 0, 'misses': 0, 'stale': 0 }
+
+    @property
+    def ttl(self):
+        return self._ttl
+
+    @ttl.setter
+    def ttl(self, value):
+        self._ttl = value
+
+    def put(self, thermostat, fetched=None):
+        with self._lock:
+            self._entries[str(thermostat.serial_number)] = (thermostat, fetched or time.time())
+
+    # Returns the cached snapshot if it is younger than the TTL, otherwise None
+    def get(self, serial_number):
+        with self._lock:
+            entry = self._entries.get(str(serial_number))
+            if entry is None:
+                self._stats['misses'] += 1
+                return None
+            if (time.time() - entry[1]) > self._ttl:
+                self._stats['stale'] += 1
+                return None
+            self._stats['hits'] += 1
+            return entry[0]
+
+    # Returns the cached snapshot regardless of its age
+    def peek(self, serial_number):
+        with self._lock:
+            entry = self._entries.get(str(serial_number))
+            return entry[0] if entry is not None else None
+
+    def age(self, serial_number):
+        with self._lock:
+            entry = self._entries.get(str(serial_number))
+            return (time.time() - entry[1]) if entry is not None else None
+
+    def evict(self, serial_number):
+        with self._lock:
+            self._entries.pop(str(serial_number), None)
+
+    # Drops every entry whose serial number is not in serial_numbers
+    def retain(self, serial_numbers):
+        keep = set(str(serial_number) for serial_number in serial_numbers)
+        with self._lock:
+            for serial_number in [key for key in self._entries if key not in keep]:
+                del self._entries[serial_number]
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+            return stats
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import hashlib
+import logging
+import tempfile
+import threading
+from datetime import datetime
+from authenticator import Authentication, AuthenticationState
+
+TOKEN_FILE_NAME = "session_tokens.json"
+EXPIRES_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+class TokenStore:
+
+    # Keeps each account's session ID and expiry in a JSON file readable only by the plugin's user,
+    # so a restarted plugin can reuse a session that is still valid instead of logging in again
+    def __init__(self, folder):
+        self._folder = folder
+        self._path = os.path.join(folder, TOKEN_FILE_NAME)
+        self._lock = threading.Lock()
+        self.logger = logging.getLogger("Plugin.TokenStore")
+
+    # Returns an AUTHENTICATED Authentication for the account, or None if nothing usable is stored.
+    # Expiry is checked by Authenticator when the result is passed to it as the authentication cache
+    def load(self, email):
+        with self._lock:
+            entry = self._read().get(_account_key(email))
+        if entry is None:
+            return None
+        try:
+            expires = datetime.strptime(entry["expires"], EXPIRES_FORMAT)
+            return Authentication(AuthenticationState.AUTHENTICATED, entry["session_id"], expires)
+        except (KeyError, TypeError, ValueError) as error:
+            self.logger.warning(f"Ignoring stored session - {error}")
+            return None
+
+    def save(self, email, authentication):
+        if authentication.state is not AuthenticationState.AUTHENTICATED or authentication.expires is None:
+            return
+        with self._lock:
+            tokens = self._read()
+            tokens[_account_key(email)] = {
+                "session_id": authentication.session_id[0],
+                "expires": authentication.expires.strftime(EXPIRES_FORMAT),
+            }
+            self._write(tokens)
+
+    def discard(self, email):
+        with self._lock:
+            tokens = self._read()
+            if tokens.pop(_account_key(email), None) is not None:
+                self._write(tokens)
+
+    def _read(self):
+        try:
+            with open(self._path, "r") as token_file:
+                return json.load(token_file)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as error:
+            self.logger.warning(f"Unable to read session store - {error}")
+            return {}
+
+    # Writes to a private temporary file in the same folder and renames it over the store
+    def _write(self, tokens):
+        try:
+            os.makedirs(self._folder, mode=0o700, exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(prefix=".tokens-", dir=self._folder)
+            try:
+                os.fchmod(fd, 0o600)
+                with os.fdopen(fd, "w") as token_file:
+                    json.dump(tokens, token_file)
+                    token_file.flush()
+                    os.fsync(token_file.fileno())
+                os.replace(temp_path, self._path)
+            except BaseException:
+                os.unlink(temp_path)
+                raise
+        except OSError as error:
+            self.logger.error(f"Unable to write session store - {error}")
+
+# Accounts are stored under a hash of the login rather than the email address itself
+def _account_key(email):
+    return hashlib.sha256(email.strip().lower().encode("utf-8")).hexdigest()
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+from enum import Enum
+
+class WakeEvent(Enum):
+    REFRESH_DEVICE = "refresh_device"   # key is the Indigo device ID
+    REFRESH_ALL = "refresh_all"
+    REAUTHENTICATE = "reauthenticate"
+    RESCHEDULE = "reschedule"           # a poll was scheduled before the one the loop is sleeping until
+    STOP = "stop"
+
+class WakeQueue:
+
+    # Work posted for runConcurrentThread by actions, config changes and authentication failures.
+    # wait() sleeps until something is posted or the deadline passes, then hands back everything posted
+    # since the previous wait. Posting an event that is already queued does nothing
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._events = {}
+        self._stats = { 'posted': 0, 'merged': 0, 'woken': 0, 'timed_out': 0 }
+
+    def post(self, event, key=None):
+        with self._condition:
+            self._stats['posted'] += 1
+            if (event, key) in self._events:
+                self._stats['merged'] += 1
+                return
+            self._events[(event, key)] = None
+            self._condition.notify()
+
+    # Returns the queued (event, key) pairs in the order they were posted; an empty list means the deadline passed.
+    # A deadline of None waits until something is posted
+    def wait(self, deadline):
+        with self._condition:
+            while len(self._events) == 0:
+                timeout = deadline - time.time() if deadline is not None else None
+                if timeout is not None and timeout <= 0:
+                    self._stats['timed_out'] += 1
+                    return []
+                self._condition.wait(timeout)
+            events = list(self._events.keys())
+            self._events = {}
+            self._stats['woken'] += 1
+            return events
+
+    def stats(self):
+        with self._condition:
+            return dict(self._stats)
@@ -0,0 +1,128 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Drives the real Plugin class on the headless Indigo runtime against the local fake server and reports,
+# per thermostat count, how long startup, a full refresh cycle and a burst of setpoint actions take, how many
+# IPC calls each makes per device, and where the callback time goes.
+#
+#   python3 bench_plugin.py --sizes 10 100 --output plugin.json
+
+import argparse
+import json
+import logging
+import time
+
+from bench_polling import use_api_base_url, git_revision, EMAIL, PASSWORD
+from fake_schluter_server import FakeSchluterServer
+from headless_indigo import HeadlessIndigo
+from wake_queue import WakeEvent
+
+DEFAULT_SIZES = [1, 10, 100]
+
+def prefs(args):
+    return {
+        "login": EMAIL,
+        "password": PASSWORD,
+        "logLevel": str(args.log_level),
+        "updateFrequency": "10",
+        "bulkRefresh": not args.no_bulk,
+        "refreshConcurrency": str(args.concurrency),
+        "temperatureScale": "C",
+    }
+
+def per_device(ipc_calls, devices):
+    return { name: count / devices for name, count in ipc_calls.items() }
+
+# Refreshes run on each account's own thread after the loop pass that queued them
+def drain_accounts(runtime):
+    for account in list(runtime.plugin.accounts.values()):
+        account.drain()
+
+def run_size(server, count, args):
+    server.set_thermostat_count(count)
+    runtime = HeadlessIndigo(sleep_scale=args.sleep_scale)
+    runtime.load_plugin(prefs(args))
+    devices = [runtime.add_device(f"Thermostat {serial_number}", serial_number) for serial_number in server.serial_numbers()]
+    kThermostatAction = runtime.indigo.kThermostatAction
+
+    results = { 'thermostats': count }
+    started = time.perf_counter()
+    runtime.start()
+    runtime.wait_for_passes(1)
+    drain_accounts(runtime)
+    results['startup_ms'] = (time.perf_counter() - started) * 1000.0
+    results['startup'] = runtime.report()
+
+    # Full refresh cycles, requested the way a config change does
+    runtime.reset_counters()
+    samples = []
+    for _ in range(args.cycles):
+        started = time.perf_counter()
+        passes = runtime.loop_passes.calls
+        runtime.plugin.wakeQueue.post(WakeEvent.REFRESH_ALL)
+        runtime.wait_for_passes(passes + 1 - runtime.loop_passes.calls)
+        drain_accounts(runtime)
+        samples.append((time.perf_counter() - started) * 1000.0)
+    report = runtime.report()
+    results['refresh_cycle_ms'] = sorted(samples)[len(samples) // 2]
+    results['refresh'] = report
+    results['refresh_ipc_per_device_cycle'] = per_device(report['ipc_calls'], count * args.cycles)
+
+    # Bursts of setpoint clicks on up to ten devices, left to settle in the command coalescer
+    runtime.reset_counters()
+    server.reset_request_counts()
+    for dev in devices[:10]:
+        for _ in range(args.clicks):
+            runtime.action(dev, kThermostatAction.IncreaseHeatSetpoint)
+    time.sleep(args.settle)
+    results['commands'] = runtime.report()
+    results['commands']['requests'] = server.request_counts()
+
+    runtime.stop()
+    return results
+
+def print_report(report):
+    print(f"Headless plugin benchmark - revision {report['meta']['revision']}, latency {report['meta']['latency']} s")
+    print(f"{'thermostats':>11}  {'startup ms':>10}  {'refresh ms':>10}  {'loop pass ms':>12}  {'IPC/device/cycle':>16}")
+    for size, results in report['results'].items():
+        ipc = sum(value for name, value in results['refresh_ipc_per_device_cycle'].items() if name != "states written")
+        print(f"{size:>11}  {results['startup_ms']:>10.1f}  {results['refresh_cycle_ms']:>10.1f}  {results['refresh']['loop_passes']['mean_ms'] or 0:>12.2f}  {ipc:>16.2f}")
+    for size, results in report['results'].items():
+        print(f"\n{size} thermostats, refresh cycles - callback time:")
+        for name, timer in sorted(results['refresh']['callbacks'].items(), key=lambda item: -item[1]['total_ms']):
+            print(f"  {name:<28} {timer['calls']:>7} calls  {timer['total_ms']:>10.2f} ms total  {timer['mean_ms']:>8.3f} ms mean")
+        print(f"  IPC calls: {results['refresh']['ipc_calls']}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Profile the Plugin class on the headless Indigo runtime")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--cycles", type=int, default=5, help="full refresh cycles to time")
+    parser.add_argument("--clicks", type=int, default=5, help="setpoint clicks per device in the command burst")
+    parser.add_argument("--settle", type=float, default=3.0, help="seconds to wait for coalesced commands")
+    parser.add_argument("--sleep-scale", type=float, default=0.01, help="factor applied to the plugin's sleep()")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--no-bulk", action="store_true", help="refresh each device with its own request")
+    parser.add_argument("--log-level", type=int, default=logging.INFO)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--output", help="write the report as JSON to this file")
+    args = parser.parse_args()
+
+    server = FakeSchluterServer(latency=args.latency).start()
+    use_api_base_url(server.base_url)
+    try:
+        report = {
+            'meta': { 'revision': git_revision(), 'timestamp': time.strftime("%Y-%m-%dT%H:%M:%S"), 'latency': args.latency, 'bulk': not args.no_bulk, 'cycles': args.cycles },
+            'results': {},
+        }
+        for count in args.sizes:
+            report['results'][str(count)] = run_size(server, count, args)
+    finally:
+        server.stop()
+
+    print_report(report)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(report, output_file, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Benchmarks the Schluter client against the local fake server at several account sizes:
+#   bulk_refresh        one GET /api/thermostats, parsed into Schluter_Thermo objects
+#   per_device_refresh  one GET /api/thermostat per thermostat, the plugin's non-bulk refresh cycle
+#   command_round_trip  POST /api/thermostat followed by the GET that confirms it
+#   memory              bytes held by a Schluter client plus the parsed thermostats
+#
+#   python3 bench_polling.py --output before.json
+#   python3 bench_polling.py --output after.json --compare before.json
+
+import argparse
+import gc
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+PLUGIN_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Schluter-1.indigoPlugin", "Contents", "Server Plugin")
+sys.path.insert(0, PLUGIN_FOLDER)
+
+import schluter
+from schluter import Schluter
+from schluter_thermo import Schluter_Thermo
+from account import SchluterAccount
+from fake_schluter_server import FakeSchluterServer
+
+DEFAULT_SIZES = [1, 10, 100, 1000]
+EMAIL = "bench@example.com"
+PASSWORD = "bench"
+
+# Points the client modules at base_url instead of the Schluter cloud
+def use_api_base_url(base_url):
+    modules = [schluter]
+    if "async_schluter" in sys.modules:
+        modules.append(sys.modules["async_schluter"])
+    for module in modules:
+        for name in ("API_AUTH_URL", "API_USERACCOUNT_URL", "API_GET_THERMOSTATS_URL", "API_SET_TEMPERATURE_URL"):
+            if hasattr(module, name):
+                setattr(module, name, getattr(module, name).replace(schluter.API_BASE_URL, base_url))
+    schluter.API_BASE_URL = base_url
+
+def summarize(samples, failures):
+    ordered = sorted(samples)
+    return {
+        'runs': len(ordered),
+        'failures': failures,
+        'min_ms': ordered[0],
+        'median_ms': statistics.median(ordered),
+        'p95_ms': ordered[min(len(ordered) - 1, int(round(0.95 * (len(ordered) - 1))))],
+        'mean_ms': statistics.fmean(ordered),
+    }
+
+# function() returns the number of failed requests in the sample; samples are timed whether or not they failed
+def timed(function, repeats):
+    samples = []
+    failures = 0
+    for _ in range(repeats):
+        started = time.perf_counter()
+        failures += function()
+        samples.append((time.perf_counter() - started) * 1000.0)
+    return summarize(samples, failures)
+
+def login(client):
+    response = client.get_session(EMAIL, PASSWORD)
+    if response is None:
+        raise RuntimeError("Unable to log in to the fake server")
+    return response.json()["SessionId"]
+
+# Re-authenticator for sessions expired by --session-lifetime. Renews through the plugin's SchluterAccount,
+# which also hands the new session to the client; like the plugin, later requests use the new session
+def renew(account, session):
+    session['id'] = account.reauthenticate()
+    return session['id']
+
+# Expires every session and checks that the next request renews it and succeeds
+def check_renewal(server, client, session, serial_number):
+    renewals = client.auth_stats()['renewals']
+    server.expire_sessions()
+    started = time.perf_counter()
+    if client.get_thermostat(session['id'], serial_number) is None or client.auth_stats()['renewals'] != renewals + 1:
+        raise RuntimeError("Session renewal failed")
+    return (time.perf_counter() - started) * 1000.0
+
+def bench_bulk_refresh(client, session, repeats):
+    def refresh():
+        return 1 if client.get_thermostats(session['id']) is None else 0
+    return timed(refresh, repeats)
+
+def bench_per_device_refresh(client, session, serial_numbers, repeats):
+    def refresh():
+        failures = 0
+        for serial_number in serial_numbers:
+            response = client.get_thermostat(session['id'], serial_number)
+            if response is None:
+                failures += 1
+            else:
+                Schluter_Thermo(response.json())
+        return failures
+    return timed(refresh, repeats)
+
+def bench_command_round_trip(client, session, serial_number, repeats):
+    setpoints = [2100, 2200]
+    def round_trip():
+        setpoint = setpoints[0]
+        setpoints.reverse()
+        if not client.set_temp_next_sched(session['id'], serial_number, setpoint, "01/01/1970 00:00:00 +00:00"):
+            return 1
+        response = client.get_thermostat(session['id'], serial_number)
+        if response is None:
+            return 1
+        Schluter_Thermo(response.json())
+        return 0
+    return timed(round_trip, repeats)
+
+# Memory retained by a logged-in client holding one refresh worth of thermostats, and the peak while parsing it
+def bench_memory(count):
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        client = Schluter()
+        session_id = login(client)
+        thermostats = client.get_thermostats(session_id) or []
+        gc.collect()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    retained = current - before
+    result = {
+        'retained_bytes': retained,
+        'peak_bytes': peak - before,
+        'bytes_per_thermostat': retained / count,
+        'thermostats_parsed': len(thermostats),
+    }
+    client.close()
+    return result
+
+def run_size(server, count, args):
+    server.set_thermostat_count(count)
+    server.reset_request_counts()
+    serial_numbers = server.serial_numbers()
+
+    client = Schluter()
+    account = SchluterAccount("bench", EMAIL, EMAIL, PASSWORD, client, None)
+    session = { 'id': account.authenticate().session_id }
+    client.set_reauthenticator(lambda: renew(account, session))
+    # Warm the connection pool so the first sample doesn't pay for the TCP handshake
+    client.get_thermostats(session['id'])
+
+    results = { 'thermostats': count }
+    results['bulk_refresh'] = bench_bulk_refresh(client, session, args.repeats)
+    if count <= args.per_device_limit:
+        results['per_device_refresh'] = bench_per_device_refresh(client, session, serial_numbers, max(1, args.repeats // 5))
+    results['command_round_trip'] = bench_command_round_trip(client, session, serial_numbers[0], args.repeats)
+    results['renewal_ms'] = check_renewal(server, client, session, serial_numbers[0])
+    results['memory'] = bench_memory(count)
+    results['connections'] = client.connection_stats()
+    results['requests'] = server.request_counts()
+    client.close()
+    return results
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+# Flattens a report into {"100 bulk_refresh median_ms": value} so two reports can be compared key by key
+def flatten(report):
+    values = {}
+    for size, results in report['results'].items():
+        for benchmark in ("bulk_refresh", "per_device_refresh", "command_round_trip"):
+            if benchmark in results:
+                values[f"{size} {benchmark} median_ms"] = results[benchmark]['median_ms']
+                values[f"{size} {benchmark} p95_ms"] = results[benchmark]['p95_ms']
+        values[f"{size} memory retained_bytes"] = results['memory']['retained_bytes']
+        values[f"{size} memory peak_bytes"] = results['memory']['peak_bytes']
+    return values
+
+def print_report(report):
+    print(f"Schluter client benchmark - revision {report['meta']['revision']}, Python {report['meta']['python']}, latency {report['meta']['latency']} s")
+    print(f"{'thermostats':>11}  {'bulk ms':>9}  {'per-device ms':>13}  {'command ms':>10}  {'retained KiB':>12}  {'B/thermostat':>12}")
+    for size, results in report['results'].items():
+        per_device = results.get('per_device_refresh')
+        print(f"{size:>11}  {results['bulk_refresh']['median_ms']:>9.2f}  {(format(per_device['median_ms'], '.2f') if per_device else '-'):>13}  "
+              f"{results['command_round_trip']['median_ms']:>10.2f}  {results['memory']['retained_bytes'] / 1024:>12.1f}  {results['memory']['bytes_per_thermostat']:>12.0f}")
+
+def print_comparison(report, baseline):
+    current = flatten(report)
+    previous = flatten(baseline)
+    print(f"\nCompared with revision {baseline['meta'].get('revision')}:")
+    for key, value in current.items():
+        if key not in previous or not previous[key]:
+            continue
+        change = (value - previous[key]) / previous[key] * 100.0
+        print(f"  {key:<40} {previous[key]:>14.2f} -> {value:>14.2f}  {change:+7.1f}%")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Schluter client against the local fake server")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="thermostat counts to benchmark")
+    parser.add_argument("--repeats", type=int, default=20, help="samples per benchmark")
+    parser.add_argument("--per-device-limit", type=int, default=1000, help="skip the per-device refresh above this many thermostats")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds the fake server adds to every request")
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--session-lifetime", type=float, default=None, help="seconds before the fake server answers a session with 401")
+    parser.add_argument("--verbose", action="store_true", help="show the client's error log")
+    parser.add_argument("--output", help="write the report as JSON to this file")
+    parser.add_argument("--compare", help="JSON report from an earlier run to compare against")
+    args = parser.parse_args()
+
+    if not args.verbose:
+        logging.getLogger("Plugin").setLevel(logging.CRITICAL)
+
+    server = FakeSchluterServer(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate, session_lifetime=args.session_lifetime).start()
+    use_api_base_url(server.base_url)
+    try:
+        report = {
+            'meta': {
+                'revision': git_revision(),
+                'timestamp': time.strftime("%Y-%m-%dT%H:%M:%S"),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'latency': args.latency,
+                'jitter': args.jitter,
+                'error_rate': args.error_rate,
+                'session_lifetime': args.session_lifetime,
+                'repeats': args.repeats,
+            },
+            'results': {},
+        }
+        for count in args.sizes:
+            report['results'][str(count)] = run_size(server, count, args)
+    finally:
+        server.stop()
+
+    print_report(report)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(report, output_file, indent=2)
+    if args.compare:
+        with open(args.compare, "r") as baseline_file:
+            print_comparison(report, json.load(baseline_file))
+
+if __name__ == "__main__":
+    main()
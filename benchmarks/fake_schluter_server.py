@@ -0,0 +1,265 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Local stand-in for the ditra-heat-e-wifi.schluter.com API, for benchmarking the plugin without the cloud.
+# Implements /api/authenticate/user, /api/thermostats and /api/thermostat GET/POST with payloads carrying
+# every field Schluter_Thermo parses, plus configurable latency, error rate and session expiry.
+#
+#   python3 fake_schluter_server.py --port 8080 --thermostats 20 --latency 0.05 --error-rate 0.01
+
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+THERMOSTATS_PER_GROUP = 8
+ROOMS = ["Bathroom", "Ensuite", "Kitchen", "Mudroom", "Basement", "Laundry", "Hallway", "Powder Room"]
+
+# Typical weekday/weekend programme: wake, leave, return, sleep
+WEEKDAY_EVENTS = [("06:00:00", 2200), ("08:30:00", 1800), ("17:00:00", 2200), ("22:30:00", 1800)]
+WEEKEND_EVENTS = [("07:30:00", 2200), ("10:00:00", 2100), ("17:00:00", 2200), ("23:00:00", 1800)]
+
+def make_schedules():
+    schedules = []
+    for weekday in range(7):
+        events = WEEKEND_EVENTS if weekday >= 5 else WEEKDAY_EVENTS
+        schedules.append({
+            "WeekDayGrpNo": weekday + 1,
+            "Events": [{ "ScheduleType": index, "Clock": clock, "Temp": temp, "Active": True } for index, (clock, temp) in enumerate(events)],
+        })
+    return schedules
+
+def make_thermostat(index, rng):
+    group = index // THERMOSTATS_PER_GROUP
+    return {
+        "SerialNumber": str(700000 + index),
+        "Room": f"{ROOMS[index % len(ROOMS)]} {index + 1}",
+        "GroupId": 1000 + group,
+        "GroupName": f"Floor {group + 1}",
+        "Temperature": rng.randint(1800, 2600),
+        "SetPointTemp": 2200,
+        "RegulationMode": 1,
+        "VacationEnabled": False,
+        "VacationBeginDay": "1970-01-01T00:00:00",
+        "VacationEndDay": "1970-01-01T00:00:00",
+        "VacationTemperature": 1500,
+        "ComfortTemperature": 2300,
+        "ComfortEndTime": "01/01/1970 00:00:00 +00:00",
+        "ManualTemperature": 2000,
+        "Online": True,
+        "Heating": rng.random() < 0.5,
+        "EarlyStartOfHeating": False,
+        "MaxTemp": 4000,
+        "MinTemp": 500,
+        "ErrorCode": 0,
+        "TZOffset": "-05:00",
+        "KwhCharge": round(rng.uniform(0.08, 0.25), 3),
+        "LoadMeasuredWatt": rng.choice([0, 0, 150, 300, 450]),
+        "SWVersion": "1.0.24",
+        "Schedules": make_schedules(),
+    }
+
+class FakeSchluterServer:
+
+    def __init__(self, thermostats=10, latency=0.0, jitter=0.0, error_rate=0.0, session_lifetime=None, host="127.0.0.1", port=0, seed=1):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.session_lifetime = session_lifetime
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._sessions = {}
+        self._thermostats = {}
+        self._requests = {}
+        self.set_thermostat_count(thermostats)
+
+        server = self
+        class Handler(FakeSchluterHandler):
+            fake = server
+        self._httpd = ThreadingHTTPServer((host, port), Handler)
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="FakeSchluterServer", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def set_thermostat_count(self, count):
+        with self._lock:
+            self._thermostats = {}
+            for index in range(count):
+                thermostat = make_thermostat(index, self._rng)
+                self._thermostats[thermostat["SerialNumber"]] = thermostat
+
+    def serial_numbers(self):
+        with self._lock:
+            return list(self._thermostats.keys())
+
+    # Invalidates every session, so the next request with one gets a 401
+    def expire_sessions(self):
+        with self._lock:
+            self._sessions = {}
+
+    def request_counts(self):
+        with self._lock:
+            return dict(self._requests)
+
+    def reset_request_counts(self):
+        with self._lock:
+            self._requests = {}
+
+    # Request handling, called from the handler threads
+
+    def count(self, name):
+        with self._lock:
+            self._requests[name] = self._requests.get(name, 0) + 1
+
+    def delay(self):
+        delay = self.latency + (self._rng.uniform(0.0, self.jitter) if self.jitter > 0 else 0.0)
+        if delay > 0:
+            time.sleep(delay)
+
+    def should_fail(self):
+        return self.error_rate > 0 and self._rng.random() < self.error_rate
+
+    def login(self, email, password):
+        if not email or "@" not in email:
+            return { "SessionId": "", "ErrorCode": 1 }
+        if password == "bad":
+            return { "SessionId": "", "ErrorCode": 2 }
+        session_id = uuid.uuid4().hex
+        with self._lock:
+            self._sessions[session_id] = time.time() + self.session_lifetime if self.session_lifetime else None
+        return { "SessionId": session_id, "ErrorCode": 0, "NewAccount": False, "UserAccountId": 1 }
+
+    def session_valid(self, session_id):
+        with self._lock:
+            if session_id not in self._sessions:
+                return False
+            expires = self._sessions[session_id]
+            if expires is not None and time.time() > expires:
+                del self._sessions[session_id]
+                return False
+            return True
+
+    def thermostats_payload(self):
+        with self._lock:
+            groups = {}
+            for thermostat in self._thermostats.values():
+                group = groups.setdefault(thermostat["GroupId"], { "GroupId": thermostat["GroupId"], "GroupName": thermostat["GroupName"], "Thermostats": [] })
+                group["Thermostats"].append(thermostat)
+            return json.dumps({ "Groups": list(groups.values()) }).encode("utf-8")
+
+    def thermostat_payload(self, serial_number):
+        with self._lock:
+            thermostat = self._thermostats.get(serial_number)
+            return json.dumps(thermostat).encode("utf-8") if thermostat is not None else None
+
+    # Applies a POST /api/thermostat body the way the cloud does for the three regulation modes the plugin uses
+    def update_thermostat(self, serial_number, body):
+        with self._lock:
+            thermostat = self._thermostats.get(serial_number)
+            if thermostat is None:
+                return False
+            for key in ("RegulationMode", "ComfortTemperature", "ComfortEndTime", "ManualTemperature", "VacationEnabled"):
+                if key in body:
+                    thermostat[key] = body[key]
+            return True
+
+class FakeSchluterHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out as separate writes; without this, delayed ACKs add ~40 ms to every keep-alive request
+    disable_nagle_algorithm = True
+    fake = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        if url.path == "/api/thermostats":
+            self._handle("thermostats", query, lambda: self._send(200, self.fake.thermostats_payload()))
+        elif url.path == "/api/thermostat":
+            self._handle("thermostat GET", query, lambda: self._send_thermostat(query))
+        else:
+            self._send(404, b"{}")
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        if url.path == "/api/authenticate/user":
+            self.fake.count("auth")
+            self.fake.delay()
+            self._send(200, json.dumps(self.fake.login(body.get("Email"), body.get("Password"))).encode("utf-8"))
+        elif url.path == "/api/thermostat":
+            self._handle("thermostat POST", query, lambda: self._update_thermostat(query, body))
+        else:
+            self._send(404, b"{}")
+
+    def _handle(self, name, query, respond):
+        self.fake.count(name)
+        self.fake.delay()
+        if not self.fake.session_valid(query.get("sessionId", [None])[0]):
+            self._send(401, b'{"Message":"Authorization has been denied for this request."}')
+        elif self.fake.should_fail():
+            self._send(500, b'{"Message":"An error has occurred."}')
+        else:
+            respond()
+
+    def _send_thermostat(self, query):
+        payload = self.fake.thermostat_payload(query.get("serialnumber", [None])[0])
+        if payload is None:
+            self._send(404, b"{}")
+        else:
+            self._send(200, payload)
+
+    def _update_thermostat(self, query, body):
+        if self.fake.update_thermostat(query.get("serialnumber", [None])[0], body):
+            self._send(200, b'{"Success":true}')
+        else:
+            self._send(404, b"{}")
+
+    def _send(self, status, payload):
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the Schluter DITRA-HEAT cloud API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--thermostats", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every request")
+    parser.add_argument("--jitter", type=float, default=0.0, help="random extra seconds, up to this much")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of API requests answered with 500")
+    parser.add_argument("--session-lifetime", type=float, default=None, help="seconds before a session gets 401s")
+    args = parser.parse_args()
+
+    server = FakeSchluterServer(args.thermostats, args.latency, args.jitter, args.error_rate, args.session_lifetime, args.host, args.port)
+    print(f"Serving {args.thermostats} thermostats on {server.base_url}")
+    try:
+        server._httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
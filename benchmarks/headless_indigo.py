@@ -0,0 +1,435 @@
+# -*- coding: utf-8 -*-
+
+# Headless stand-in for the Indigo runtime, so the real Plugin class can be driven and profiled on any machine.
+#
+#   runtime = HeadlessIndigo()                      # registers the fake `indigo` module
+#   plugin = runtime.load_plugin({ "login": ..., "password": ... })
+#   runtime.add_device("Bathroom", "700000")
+#   runtime.start()                                 # startup, deviceStartComm, runConcurrentThread
+#   runtime.action(dev, runtime.indigo.kThermostatAction.IncreaseHeatSetpoint)
+#   runtime.stop()
+#   print(runtime.report())
+#
+# Every call that crosses the plugin/server boundary in real Indigo (state writes, device lookups, log
+# records sent to the event log, ...) is counted as an IPC call, and the plugin's callbacks are timed.
+
+import enum
+import importlib
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import types
+from collections import Counter
+
+PLUGIN_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Schluter-1.indigoPlugin", "Contents", "Server Plugin")
+PLUGIN_ID = "com.mkuchnic.indigoplugin.schluter"
+PLUGIN_DISPLAY_NAME = "Schluter Thermostat"
+PLUGIN_VERSION = "2023.1.1"
+
+# Callbacks Indigo calls on the plugin, plus the internal hot paths worth timing
+CALLBACKS = (
+    "startup", "shutdown", "deviceStartComm", "deviceStopComm", "getDeviceStateList",
+    "actionControlThermostat", "actionResumeProgram", "actionSetTemperature", "menuResumeProgram",
+    "serialNumberListGenerator", "validatePrefsConfigUi", "closedPrefsConfigUi",
+    "_refreshAllDevices", "_refreshDueDevices", "_refreshStatesFromHardware", "_updateDeviceStatesList", "_pushChangedStates",
+)
+
+# Native states Indigo gives every thermostat device, ahead of the plugin's custom states
+THERMOSTAT_STATES = (
+    ("hvacOperationMode", 100), ("hvacFanMode", 100), ("hvacCoolerIsOn", 52), ("hvacHeaterIsOn", 52), ("hvacFanIsOn", 52),
+    ("setpointHeat", 100), ("setpointCool", 100), ("temperatureInput1", 100), ("humidityInput1", 100),
+)
+
+class kHvacMode(enum.IntEnum):
+    Off = 0
+    Heat = 1
+    Cool = 2
+    HeatCool = 3
+    ProgramHeat = 4
+    ProgramCool = 5
+    ProgramHeatCool = 6
+
+class kFanMode(enum.IntEnum):
+    Auto = 0
+    AlwaysOn = 1
+
+class kThermostatAction(enum.IntEnum):
+    SetHvacMode = 0
+    SetFanMode = 1
+    SetCoolSetpoint = 2
+    SetHeatSetpoint = 3
+    IncreaseCoolSetpoint = 4
+    DecreaseCoolSetpoint = 5
+    IncreaseHeatSetpoint = 6
+    DecreaseHeatSetpoint = 7
+    RequestStatusAll = 8
+    RequestMode = 9
+    RequestEquipmentState = 10
+    RequestTemperatures = 11
+    RequestHumidities = 12
+    RequestDeadbands = 13
+    RequestSetpoints = 14
+
+class Dict(dict):
+
+    def to_dict(self):
+        return dict(self)
+
+class List(list):
+    pass
+
+class Action:
+
+    def __init__(self, deviceId=0, thermostatAction=None, actionValue=None, props=None):
+        self.deviceId = deviceId
+        self.thermostatAction = thermostatAction
+        self.actionValue = actionValue
+        self.props = Dict(props or {})
+
+class Device:
+
+    def __init__(self, runtime, id, name, deviceTypeId, pluginProps):
+        self._runtime = runtime
+        self.id = id
+        self.name = name
+        self.deviceTypeId = deviceTypeId
+        self.model = "DITRA-HEAT-E-WIFI"
+        self.enabled = True
+        self.configured = True
+        self.displayStateId = "temperatureInput1"
+        self.pluginProps = Dict(pluginProps)
+        self.address = pluginProps.get("address", "")
+        self.states = Dict()
+        self.stateWrites = 0
+
+    @property
+    def heatSetpoint(self):
+        return self.states.get("setpointHeat", 0.0)
+
+    @property
+    def coolSetpoint(self):
+        return self.states.get("setpointCool", 0.0)
+
+    @property
+    def hvacMode(self):
+        return self.states.get("hvacOperationMode", kHvacMode.Off)
+
+    @property
+    def temperatures(self):
+        return [self.states.get("temperatureInput1", 0.0)]
+
+    def updateStatesOnServer(self, stateList):
+        self._runtime.ipc("updateStatesOnServer")
+        self._runtime.ipc("states written", len(stateList))
+        self._apply(stateList)
+
+    def updateStateOnServer(self, key, value, uiValue=None, decimalPlaces=None):
+        self._runtime.ipc("updateStateOnServer")
+        self._runtime.ipc("states written")
+        self._apply([{ 'key': key, 'value': value, 'uiValue': uiValue }])
+
+    def stateListOrDisplayStateIdChanged(self):
+        self._runtime.ipc("stateListOrDisplayStateIdChanged")
+
+    def replacePluginPropsOnServer(self, props):
+        self._runtime.ipc("replacePluginPropsOnServer")
+        self.pluginProps = Dict(props)
+
+    def refreshFromServer(self):
+        self._runtime.ipc("refreshFromServer")
+
+    def _apply(self, stateList):
+        with self._runtime.lock:
+            for state in stateList:
+                self.states[state['key']] = state['value']
+                if state.get('uiValue') is not None:
+                    self.states[state['key'] + ".ui"] = state['uiValue']
+            self.stateWrites += 1
+
+class DeviceList:
+
+    def __init__(self, runtime):
+        self._runtime = runtime
+        self._devices = {}
+
+    def __getitem__(self, key):
+        self._runtime.ipc("devices[]")
+        if isinstance(key, str):
+            for dev in self._devices.values():
+                if dev.name == key:
+                    return dev
+        return self._devices[key]
+
+    def __contains__(self, key):
+        return key in self._devices or any(dev.name == key for dev in self._devices.values())
+
+    def __len__(self):
+        return len(self._devices)
+
+    # "self" and the plugin ID both select this plugin's devices, which are the only ones here
+    # Supports the "self" and "self.<deviceTypeId>" filters
+    def iter(self, filter=None):
+        self._runtime.ipc("devices.iter")
+        devices = list(self._devices.values())
+        if filter is not None and filter.startswith("self."):
+            devices = [dev for dev in devices if dev.deviceTypeId == filter[len("self."):]]
+        return iter(devices)
+
+    def add(self, dev):
+        self._devices[dev.id] = dev
+
+    def remove(self, dev):
+        self._devices.pop(dev.id, None)
+
+class Server:
+
+    def __init__(self, runtime, install_folder):
+        self._runtime = runtime
+        self._install_folder = install_folder
+
+    def getInstallFolderPath(self):
+        self._runtime.ipc("server.getInstallFolderPath")
+        return self._install_folder
+
+    def log(self, message, type=None, isError=False, level=logging.INFO):
+        self._runtime.ipc("server.log")
+
+# Event log handler; in Indigo every record it accepts is sent to the server
+class EventLogHandler(logging.Handler):
+
+    def __init__(self, runtime):
+        super().__init__()
+        self._runtime = runtime
+        self.records = Counter()
+
+    def emit(self, record):
+        self.format(record)
+        self.records[record.levelname] += 1
+        self._runtime.ipc("event log")
+
+class StopThread(Exception):
+    pass
+
+def make_plugin_base(runtime):
+
+    class PluginBase:
+
+        StopThread = StopThread
+
+        def __init__(self, pluginId, pluginDisplayName, pluginVersion, pluginPrefs):
+            self.pluginId = pluginId
+            self.pluginDisplayName = pluginDisplayName
+            self.pluginVersion = pluginVersion
+            self.pluginPrefs = pluginPrefs
+            self.stopThread = False
+            self.logger = logging.getLogger("Plugin")
+            # Indigo leaves the logger wide open and filters at the handlers, so debug f-strings are always evaluated
+            self.logger.setLevel(logging.DEBUG)
+            self.logger.propagate = False
+            self.indigo_log_handler = EventLogHandler(runtime)
+            self.plugin_file_handler = logging.FileHandler(runtime.plugin_log_path)
+            for handler in list(self.logger.handlers):
+                self.logger.removeHandler(handler)
+            self.logger.addHandler(self.indigo_log_handler)
+            self.logger.addHandler(self.plugin_file_handler)
+
+        # Each call is one pass of runConcurrentThread; the time since the previous pass returned is the loop overhead
+        def sleep(self, seconds):
+            runtime.loop_pass_finished()
+            if runtime.stop_event.wait(seconds * runtime.sleep_scale) or self.stopThread:
+                raise self.StopThread()
+            runtime.loop_pass_started()
+
+        def stopConcurrentThread(self):
+            self.stopThread = True
+
+        def getDeviceStateList(self, dev):
+            stateList = List()
+            if dev.deviceTypeId == "SchluterThermostat":
+                for key, stateType in THERMOSTAT_STATES:
+                    stateList.append({ "Disabled": False, "Key": key, "StateLabel": key, "TriggerLabel": key, "Type": stateType })
+            return stateList
+
+        def substitute(self, text, validateOnly=False):
+            return text
+
+    return PluginBase
+
+class CallbackTimer:
+
+    def __init__(self):
+        self.calls = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, elapsed):
+        self.calls += 1
+        self.total += elapsed
+        self.max = max(self.max, elapsed)
+
+    def summary(self):
+        return {
+            'calls': self.calls,
+            'total_ms': self.total * 1000.0,
+            'mean_ms': self.total * 1000.0 / self.calls if self.calls > 0 else None,
+            'max_ms': self.max * 1000.0,
+        }
+
+class HeadlessIndigo:
+
+    # sleep_scale shrinks PluginBase.sleep and the plugin's wake queue waits, e.g. 0.01 turns a one second sleep into 10 ms
+    def __init__(self, install_folder=None, sleep_scale=1.0, plugin_log_path=os.devnull):
+        self.lock = threading.RLock()
+        self.sleep_scale = sleep_scale
+        self.plugin_log_path = plugin_log_path
+        self._owns_install_folder = install_folder is None
+        self.install_folder = install_folder or tempfile.mkdtemp(prefix="headless-indigo-")
+        self.stop_event = threading.Event()
+        self.ipc_calls = Counter()
+        self.callbacks = {}
+        self.loop_passes = CallbackTimer()
+        self._loop_started = None
+        self._next_device_id = 100000001
+        self.plugin = None
+        self.plugin_module = None
+        self._thread = None
+        self.indigo = self._install()
+
+    def _install(self):
+        module = types.ModuleType("indigo")
+        module.kHvacMode = kHvacMode
+        module.kFanMode = kFanMode
+        module.kThermostatAction = kThermostatAction
+        module.Dict = Dict
+        module.List = List
+        module.devices = DeviceList(self)
+        module.server = Server(self, self.install_folder)
+        module.PluginBase = make_plugin_base(self)
+        sys.modules["indigo"] = module
+        return module
+
+    def ipc(self, name, count=1):
+        with self.lock:
+            self.ipc_calls[name] += count
+
+    def loop_pass_started(self):
+        self._loop_started = time.perf_counter()
+
+    def loop_pass_finished(self):
+        if self._loop_started is not None:
+            self.loop_passes.record(time.perf_counter() - self._loop_started)
+            self._loop_started = None
+
+    # Imports plugin.py from the bundle (a fresh copy each time) and wraps its callbacks with timers
+    def load_plugin(self, prefs, plugin_folder=PLUGIN_FOLDER):
+        if plugin_folder not in sys.path:
+            sys.path.insert(0, plugin_folder)
+        if "plugin" in sys.modules:
+            self.plugin_module = importlib.reload(sys.modules["plugin"])
+        else:
+            self.plugin_module = importlib.import_module("plugin")
+        self.plugin = self.plugin_module.Plugin(PLUGIN_ID, PLUGIN_DISPLAY_NAME, PLUGIN_VERSION, Dict(prefs))
+        for name in CALLBACKS:
+            if hasattr(self.plugin, name):
+                setattr(self.plugin, name, self._timed(name, getattr(self.plugin, name)))
+        return self.plugin
+
+    def _timed(self, name, method):
+        timer = self.callbacks.setdefault(name, CallbackTimer())
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - started
+                with self.lock:
+                    timer.record(elapsed)
+        return timed
+
+    def add_device(self, name, serial_number, deviceTypeId="SchluterThermostat", **props):
+        props.setdefault("serialNumbers", serial_number)
+        props.setdefault("address", serial_number)
+        dev = Device(self, self._next_device_id, name, deviceTypeId, props)
+        self._next_device_id += 1
+        self.indigo.devices.add(dev)
+        return dev
+
+    def remove_device(self, dev):
+        if self._thread is not None:
+            self.plugin.deviceStopComm(dev)
+        self.indigo.devices.remove(dev)
+
+    # Runs the plugin the way Indigo does: startup, deviceStartComm for each device, then runConcurrentThread on its own thread
+    def start(self):
+        self.stop_event.clear()
+        self.plugin.startup()
+        for dev in list(self.indigo.devices._devices.values()):
+            self.plugin.getDeviceStateList(dev)
+            self.plugin.deviceStartComm(dev)
+        self._wrap_wake_queue()
+        self._thread = threading.Thread(target=self._run_concurrent_thread, name="runConcurrentThread", daemon=True)
+        self._thread.start()
+
+    def _run_concurrent_thread(self):
+        self.loop_pass_started()
+        self.plugin.runConcurrentThread()
+
+    # runConcurrentThread sleeps in the plugin's WakeQueue rather than PluginBase.sleep; its waits are
+    # scaled and timed as loop passes the same way
+    def _wrap_wake_queue(self):
+        wake_queue = getattr(self.plugin, "wakeQueue", None)
+        if wake_queue is None:
+            return
+        wait = wake_queue.wait
+        def scaled_wait(deadline):
+            self.loop_pass_finished()
+            if deadline is not None:
+                deadline = time.time() + max(deadline - time.time(), 0.0) * self.sleep_scale
+            events = wait(deadline)
+            self.loop_pass_started()
+            return events
+        wake_queue.wait = scaled_wait
+
+    def stop(self):
+        self.plugin.stopConcurrentThread()
+        self.stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        for dev in list(self.indigo.devices._devices.values()):
+            self.plugin.deviceStopComm(dev)
+        self.plugin.shutdown()
+        if self._owns_install_folder:
+            shutil.rmtree(self.install_folder, ignore_errors=True)
+
+    # Waits until runConcurrentThread has completed count more passes
+    def wait_for_passes(self, count=1, timeout=60.0):
+        target = self.loop_passes.calls + count
+        deadline = time.time() + timeout
+        while self.loop_passes.calls < target:
+            if time.time() > deadline:
+                raise TimeoutError(f"runConcurrentThread did not complete {count} passes in {timeout} seconds")
+            time.sleep(0.001)
+
+    def action(self, dev, thermostatAction, actionValue=None):
+        self.plugin.actionControlThermostat(Action(dev.id, thermostatAction, actionValue), dev)
+
+    def reset_counters(self):
+        with self.lock:
+            self.ipc_calls = Counter()
+            for timer in self.callbacks.values():
+                timer.__init__()
+            self.loop_passes = CallbackTimer()
+
+    def report(self):
+        with self.lock:
+            return {
+                'devices': len(self.indigo.devices),
+                'ipc_calls': dict(sorted(self.ipc_calls.items())),
+                'callbacks': { name: timer.summary() for name, timer in sorted(self.callbacks.items()) if timer.calls > 0 },
+                'loop_passes': self.loop_passes.summary(),
+            }